@@ -0,0 +1,165 @@
+
+##################################################################################
+### Times and memory-profiles each stage on synthetic timetables of set sizes ###
+##################################################################################
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from synthetic_timetable import generate_timetable
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = "output/benchmarks"
+WORK_DIR = "output/benchmarks/work"
+
+# Schedule records per size; the full GB extract has a few hundred thousand
+SIZES = {"small": 2_000, "medium": 20_000, "full": 400_000}
+SEED = 1
+
+# Stages in run order: (name, script and arguments, timed). Untimed stages only prepare the
+# inputs of later ones. Paths are relative to the size's working directory.
+STAGES = [
+    ("schema", ["create_schema.py"], False),
+    ("ingest", ["load_timetable_json.py", "--input", "data/timetable/toc-full"], True),
+    ("london_services", ["get_london_terminal_services.py"], True),
+    ("travel_times", ["expected_travel_times.py", "--no-cache"], True),
+    ("geocode_terminals", ["geocode_terminals.py", "--offline"], False),
+    ("geocode_stations", ["geocode_stations.py", "--offline"], False),
+    ("create_map", ["create_map.py"], True),
+]
+
+# A stage slower or larger than its baseline by more than this share counts as a regression
+TOLERANCE = 0.10
+
+
+def run_stage(argv, cwd):
+    """Run a script to completion, returning wall seconds, CPU seconds and peak RSS in MB."""
+    with tempfile.TemporaryFile(mode="w+") as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, argv[0])] + argv[1:], cwd=cwd,
+                                stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 gives this child's own resource usage rather than the total over all children
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        if os.waitstatus_to_exitcode(status) != 0:
+            stderr.seek(0)
+            raise Exception(f"{argv[0]} failed in {cwd}:\n{stderr.read()[-2000:]}")
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {"wall_s": round(wall, 3), "cpu_s": round(usage.ru_utime + usage.ru_stime, 3),
+            "peak_rss_mb": round(rss_mb, 1)}
+
+
+def prepare(size, trains, work_dir=WORK_DIR, seed=SEED):
+    """Working directory for a size with its synthetic extract, generated once per size and seed."""
+    cwd = os.path.join(work_dir, f"{size}_{trains}_{seed}")
+    toc_full = os.path.join(cwd, "data/timetable/toc-full")
+    for sub in ["db", "output"]:
+        os.makedirs(os.path.join(cwd, sub), exist_ok=True)
+    if not os.path.exists(toc_full):
+        print(f"Generating {size} timetable ({trains:,} schedules)...")
+        generate_timetable(toc_full + ".tmp", trains, seed=seed,
+                           reference_path=os.path.join(cwd, "data/station_reference.csv"))
+        os.replace(toc_full + ".tmp", toc_full)
+    return cwd
+
+
+def benchmark_size(size, trains, repeat=1, work_dir=WORK_DIR):
+    """Best wall/CPU time and largest peak RSS of each timed stage over repeat runs."""
+    cwd = prepare(size, trains, work_dir)
+    stages = {}
+    for _ in range(repeat):
+        # The loader appends to whatever is there, so every run starts from an empty database
+        db_path = os.path.join(cwd, "db/timetable.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        for name, argv, timed in STAGES:
+            result = run_stage(argv, cwd)
+            if not timed:
+                continue
+            best = stages.setdefault(name, result)
+            best["wall_s"] = min(best["wall_s"], result["wall_s"])
+            best["cpu_s"] = min(best["cpu_s"], result["cpu_s"])
+            best["peak_rss_mb"] = max(best["peak_rss_mb"], result["peak_rss_mb"])
+            print(f"  {size:<7} {name:<16} {result['wall_s']:8.2f}s {result['cpu_s']:8.2f}s cpu "
+                  f"{result['peak_rss_mb']:8.0f} MB")
+    return {"trains": trains, "input_mb": round(os.path.getsize(os.path.join(cwd, "data/timetable/toc-full"))
+                                                / 1024 ** 2, 1), "stages": stages}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Print each stage against the baseline; returns the (size, stage, metric) that regressed."""
+    regressions = []
+    print(f"\nAgainst {baseline.get('label')} ({baseline.get('revision')}):")
+    for size, current in results["sizes"].items():
+        before = baseline["sizes"].get(size)
+        if not before or before["trains"] != current["trains"]:
+            continue
+        for stage, metrics in current["stages"].items():
+            if stage not in before["stages"]:
+                continue
+            cells = []
+            for metric in ["wall_s", "peak_rss_mb"]:
+                old, new = before["stages"][stage][metric], metrics[metric]
+                change = (new - old) / old if old else 0.0
+                flag = " !" if change > tolerance else ""
+                if flag:
+                    regressions.append((size, stage, metric))
+                cells.append(f"{metric} {old:g} -> {new:g} ({change:+.0%}){flag}")
+            print(f"  {size:<7} {stage:<16} " + "   ".join(cells))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest, london services, travel times and the map "
+                                                 "on synthetic timetables.")
+    parser.add_argument("--sizes", default="small,medium",
+                        help=f"Comma-separated sizes from {', '.join(SIZES)}, or schedule counts")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per size; the best time is kept")
+    parser.add_argument("--label", default=datetime.now().strftime("%Y%m%d-%H%M%S"),
+                        help="Name of the saved results file")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Allowed slowdown or memory growth before a stage is flagged")
+    args = parser.parse_args()
+
+    results = {
+        "label": args.label,
+        "revision": git_revision(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "sizes": {},
+    }
+    for size in args.sizes.split(","):
+        trains = SIZES[size] if size in SIZES else int(size)
+        results["sizes"][size] = benchmark_size(size, trains, args.repeat)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{args.label}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
@@ -0,0 +1,98 @@
+
+###############################################################################
+### Per-train operating calendars and date-accurate STP schedule resolution ###
+###############################################################################
+
+from datetime import date
+import numpy as np
+
+# Short-term planning precedence: on any date the lowest indicator wins, and a winning
+# cancellation means the train does not run
+STP_PRECEDENCE = {"C": 0, "N": 1, "O": 2, "P": 3}
+
+_WEEKLY_REPEAT_CACHE = {}
+
+
+def encode_calendar(start_date, end_date, runs_on):
+    """Bitset of the days a schedule operates, as (first_day, bytes).
+
+    first_day is the proleptic ordinal of start_date; bit i (little-endian) is set when the
+    schedule runs on first_day + i, i.e. the date is within start/end and its weekday is
+    flagged in runs_on (Monday first).
+    """
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date) if end_date else start
+    n_days = (end - start).days + 1
+    if n_days <= 0 or not runs_on:
+        return start.toordinal(), b""
+
+    # Rotate the weekly pattern so bit 0 is the start date's weekday, then tile it
+    weekday = start.weekday()
+    rotated = runs_on[weekday:] + runs_on[:weekday]
+    pattern = sum(1 << i for i, flag in enumerate(rotated) if flag == "1")
+    weeks = (n_days + 6) // 7
+    repeat = _WEEKLY_REPEAT_CACHE.get(weeks)
+    if repeat is None:
+        repeat = _WEEKLY_REPEAT_CACHE[weeks] = ((1 << (7 * weeks)) - 1) // 127
+    bits = (pattern * repeat) & ((1 << n_days) - 1)
+    return start.toordinal(), bits.to_bytes((n_days + 7) // 8, "little")
+
+
+class CalendarIndex:
+    """Operating calendars for every train, answering "which schedules run on this date".
+
+    The bitsets are packed into one buffer so a date lookup is a handful of vectorised
+    array operations over all trains, followed by STP resolution per train UID.
+    """
+
+    def __init__(self, train_ids, train_uids, stp_indicators, first_days, calendars):
+        self.train_ids = np.asarray(train_ids, dtype=np.int64)
+        self.uid_codes = np.unique(np.asarray(train_uids, dtype=str), return_inverse=True)[1]
+        self.ranks = np.array([STP_PRECEDENCE.get(s, len(STP_PRECEDENCE)) for s in stp_indicators])
+        self.first_days = np.asarray(first_days, dtype=np.int64)
+
+        lengths = np.array([len(c) for c in calendars], dtype=np.int64)
+        self.offsets = np.r_[0, np.cumsum(lengths)[:-1]].astype(np.int64)
+        self.n_bits = lengths * 8
+        self.buffer = np.frombuffer(b"".join(calendars), dtype=np.uint8)
+
+    @classmethod
+    def from_db(cls, conn):
+        rows = conn.execute("""
+            SELECT train_id, train_uid, stp_indicator, calendar_start, calendar
+            FROM trains
+        """).fetchall()
+        if not rows:
+            return cls([], [], [], [], [])
+        train_ids, uids, stps, first_days, calendars = zip(*rows)
+        return cls(train_ids, uids, stps, first_days, [c or b"" for c in calendars])
+
+    def scheduled_on(self, day):
+        """Mask of schedules (of any STP indicator) whose calendar includes the date."""
+        offset = day.toordinal() - self.first_days
+        valid = (offset >= 0) & (offset < self.n_bits)
+        mask = np.zeros(len(self.train_ids), dtype=bool)
+        idx = np.flatnonzero(valid)
+        byte = self.buffer[self.offsets[idx] + offset[idx] // 8]
+        mask[idx] = (byte >> (offset[idx] % 8)) & 1 == 1
+        return mask
+
+    def running_on(self, day):
+        """train_ids of the schedules that actually operate on the date, after STP overlays."""
+        candidates = np.flatnonzero(self.scheduled_on(day))
+        if len(candidates) == 0:
+            return np.array([], dtype=np.int64)
+
+        # For each UID keep the candidate with the lowest STP rank
+        order = candidates[np.lexsort((self.ranks[candidates], self.uid_codes[candidates]))]
+        _, first = np.unique(self.uid_codes[order], return_index=True)
+        winners = order[first]
+        winners = winners[self.ranks[winners] != STP_PRECEDENCE["C"]]
+        return np.sort(self.train_ids[winners])
+
+
+def running_train_ids(conn, day):
+    """Convenience wrapper: the train_ids running on a date (a datetime.date or 'YYYY-MM-DD')."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return CalendarIndex.from_db(conn).running_on(day)
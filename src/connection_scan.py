@@ -0,0 +1,299 @@
+
+##################################################################################
+### Connection Scan: earliest arrivals from each terminal, including changes ###
+##################################################################################
+
+import argparse
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from datetime import date
+import metrics
+from calendar_index import CalendarIndex
+from frames import write_frame
+from expected_travel_times import (
+    DEFAULT_DAYS, DEFAULT_STEP, DEFAULT_WINDOW, DAY_NAMES, TerminalSummary, parse_days, parse_window,
+    terminal_tiplocs
+)
+from time_encoding import format_minutes
+
+DB_PATH = "db/timetable.db"
+SUMMARY_PATH = "output/expected_times_to_stops_csa.feather"
+
+# Minutes needed to change trains at a station, unless overridden per station
+DEFAULT_MIN_CHANGE = 5
+
+# How long after the window closes a journey may still arrive; None scans every later
+# connection, so no journey is cut short
+DEFAULT_HORIZON = None
+
+UNREACHED = np.iinfo(np.int32).max // 2
+
+
+# --- Connections ---
+def load_locations(db_path, days, on_date=None):
+    """Every public call of every train running on any of the given days, in train order.
+
+    With on_date, the trains are instead those the calendar says operate on that date.
+    """
+    conn = sqlite3.connect(db_path)
+    if on_date is not None:
+        running = CalendarIndex.from_db(conn).running_on(date.fromisoformat(on_date))
+        conn.execute("CREATE TEMP TABLE running (train_id INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO running VALUES (?)", ((int(t),) for t in running))
+        day_filter = "t.train_id IN (SELECT train_id FROM running)"
+    else:
+        mask = parse_days(days)
+        day_filter = " OR ".join(
+            f"substr(t.runs_on, {i + 1}, 1) = '1'" for i in range(len(DAY_NAMES)) if mask & (1 << i)
+        )
+    df = pd.read_sql_query(f"""
+        SELECT
+            tl.train_id,
+            tl.seq,
+            COALESCE(tp.station_name, tp.tiploc_code) AS stop_name,
+            tp.tiploc_code,
+            tl.arrival,
+            tl.departure
+        FROM trains t
+        JOIN train_locations tl ON tl.train_id = t.train_id
+        JOIN tiplocs tp ON tp.tiploc_id = tl.tiploc_id
+        WHERE {day_filter}
+        ORDER BY tl.train_id, tl.seq
+    """, conn)
+    conn.close()
+    return df
+
+
+def build_connections(locations):
+    """Turn consecutive calls of each train into elementary connections.
+
+    Stops are station names, so TIPLOCs sharing a name (e.g. the platforms groups at
+    London Bridge) form one interchange. Times are made monotone along each train by
+    adding a day to anything earlier than the train's first time.
+    """
+    stops, stop_codes = np.unique(locations["stop_name"].to_numpy(str), return_inverse=True)
+    train = locations["train_id"].to_numpy()
+    arr = locations["arrival"].to_numpy(float)
+    dep = locations["departure"].to_numpy(float)
+
+    first_row = np.r_[True, train[1:] != train[:-1]]
+    first_time = np.where(np.isnan(dep), arr, dep)[first_row]
+    origin = np.repeat(first_time, np.diff(np.r_[np.flatnonzero(first_row), len(train)]))
+    arr = np.where(arr < origin, arr + 1440, arr)
+    dep = np.where(dep < origin, dep + 1440, dep)
+
+    # Connection i runs from row i to row i + 1 of the same train
+    same = train[:-1] == train[1:]
+    c_dep = np.where(np.isnan(dep[:-1]), arr[:-1], dep[:-1])[same]
+    c_arr = np.where(np.isnan(arr[1:]), dep[1:], arr[1:])[same]
+    connections = pd.DataFrame({
+        "trip": np.unique(train, return_inverse=True)[1][:-1][same],
+        "from_stop": stop_codes[:-1][same],
+        "to_stop": stop_codes[1:][same],
+        "dep": c_dep,
+        "arr": c_arr,
+        "can_board": ~np.isnan(dep[:-1][same]),
+        "can_alight": ~np.isnan(arr[1:][same]),
+    })
+    connections = connections.dropna(subset=["dep", "arr"])
+    connections = connections.sort_values(["dep", "arr"], kind="stable").reset_index(drop=True)
+    connections[["dep", "arr"]] = connections[["dep", "arr"]].astype(np.int32)
+    return connections, stops
+
+
+# --- Scan ---
+def connection_scan(connections, n_stops, sources, departures, change_times):
+    """Earliest arrival at every stop for a batch of (source stops, departure time) queries.
+
+    All queries are answered in one scan over the connections, each step updating one
+    column per query. A query may board any train leaving a source stop strictly after its
+    departure time; changing trains elsewhere needs change_times[stop] minutes.
+
+    Returns (best, left), (n_stops, n_queries) int32 arrays: the earliest arrival at every
+    stop (UNREACHED where a stop cannot be reached, the departure time at a query's own
+    sources) and when that journey's first train left its source. Among equally early
+    journeys, the first one found is kept.
+    """
+    n_queries = len(departures)
+    n_trips = int(connections["trip"].max()) + 1 if len(connections) else 0
+    best = np.full((n_stops, n_queries), UNREACHED, dtype=np.int32)
+    ready = np.full((n_stops, n_queries), UNREACHED, dtype=np.int32)
+    on_trip = np.zeros((n_trips, n_queries), dtype=bool)
+    # Source departure of the journey behind each stop's label (-1 at the sources
+    # themselves) and behind each boarded trip
+    left = np.full((n_stops, n_queries), -1, dtype=np.int32)
+    trip_left = np.zeros((n_trips, n_queries), dtype=np.int32)
+
+    # No arrival beats a source's own departure time, so its label is never replaced
+    for q, (stop_ids, t) in enumerate(zip(sources, departures)):
+        best[stop_ids, q] = t
+        ready[stop_ids, q] = t + 1
+
+    trip = connections["trip"].to_numpy()
+    from_stop = connections["from_stop"].to_numpy()
+    to_stop = connections["to_stop"].to_numpy()
+    dep = connections["dep"].to_numpy()
+    arr = connections["arr"].to_numpy()
+    can_board = connections["can_board"].to_numpy()
+    can_alight = connections["can_alight"].to_numpy()
+
+    for c in range(len(trip)):
+        # A view, so boarding below marks the trip for later connections too
+        reached = on_trip[trip[c]]
+        if can_board[c]:
+            boarding = (ready[from_stop[c]] <= dep[c]) & ~reached
+            if boarding.any():
+                origin = left[from_stop[c], boarding]
+                trip_left[trip[c], boarding] = np.where(origin < 0, dep[c], origin)
+                reached |= boarding
+        if can_alight[c]:
+            s = to_stop[c]
+            improved = reached & (best[s] > arr[c])
+            if improved.any():
+                best[s, improved] = arr[c]
+                ready[s, improved] = arr[c] + change_times[s]
+                left[s, improved] = trip_left[trip[c], improved]
+    return best, left
+
+
+def profile(connections, stops, terminal_stops, window, step, min_change=DEFAULT_MIN_CHANGE,
+            change_overrides=None):
+    """Earliest arrivals from every terminal at every time point in the window, as a long table."""
+    start, end = parse_window(window)
+    time_points = np.arange(start, end, step)
+
+    change_times = np.full(len(stops), min_change, dtype=np.int32)
+    stop_index = {name: i for i, name in enumerate(stops)}
+    for name, minutes in (change_overrides or {}).items():
+        if name in stop_index:
+            change_times[stop_index[name]] = minutes
+
+    # One query per (terminal, time point)
+    terminals, sources, departures = [], [], []
+    for terminal, stop_ids in terminal_stops.items():
+        for t in time_points:
+            terminals.append(terminal)
+            sources.append(stop_ids)
+            departures.append(t)
+    departures = np.array(departures, dtype=np.int32)
+
+    best, left = connection_scan(connections, len(stops), sources, departures, change_times)
+
+    # A terminal's own stops are where the journey starts, not destinations
+    for q, stop_ids in enumerate(sources):
+        best[stop_ids, q] = UNREACHED
+
+    stop_idx, query_idx = np.nonzero(best < UNREACHED)
+    labels = np.array([format_minutes(t) for t in departures])
+    return pd.DataFrame({
+        "terminal": np.array(terminals)[query_idx],
+        "stop_name": pd.Categorical.from_codes(stop_idx, stops),
+        "minute_block": labels[query_idx],
+        "elapsed_minutes": (best[stop_idx, query_idx] - departures[query_idx]).astype(float),
+        "terminal_dep_time": left[stop_idx, query_idx],
+        "arr_time": best[stop_idx, query_idx],
+    })
+
+
+def service_counts(connections, stops, terminal_stops, window):
+    """Trains leaving each terminal within the window that call at each stop, without a change."""
+    start, end = parse_window(window)
+    frames = []
+    for terminal, stop_ids in terminal_stops.items():
+        boards = connections[connections["can_board"] & connections["from_stop"].isin(stop_ids)
+                             & (connections["dep"] >= start) & (connections["dep"] < end)]
+        first_board = boards.groupby("trip")["dep"].min().rename("board")
+        calls = connections[connections["can_alight"]].join(first_board, on="trip", how="inner")
+        calls = calls[(calls["dep"] >= calls["board"]) & ~calls["to_stop"].isin(stop_ids)]
+        counts = calls.groupby("to_stop")["trip"].nunique()
+        frames.append(pd.DataFrame({"terminal": terminal, "stop": stops[counts.index.to_numpy()],
+                                    "services": counts.to_numpy()}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["terminal", "stop", "services"])
+
+
+def summarise(results, services, cutoff=None):
+    """Per-stop summary in the layout expected_travel_times.py writes, services counting direct trains."""
+    summaries = {}
+    for terminal, rows in results.groupby("terminal", sort=False):
+        summaries.setdefault(terminal, TerminalSummary(terminal)).add(rows)
+    summary = (
+        pd.concat([s.summary() for s in summaries.values()] or [TerminalSummary("").summary()], ignore_index=True)
+        .merge(services, on=["terminal", "stop"], how="left")
+        .fillna({"services": 0})
+        .astype({"services": np.int64})
+        .sort_values(["terminal", "stop"], ignore_index=True)
+    )
+    if cutoff is not None:
+        summary = summary[summary["expected_minutes"] <= cutoff].reset_index(drop=True)
+    return summary
+
+
+def load_network(db_path=DB_PATH, days=DEFAULT_DAYS, window=DEFAULT_WINDOW, horizon=DEFAULT_HORIZON,
+                 on_date=None):
+    """Connections that could matter for departures in the window, sorted by departure time.
+
+    Returns (connections, stops, terminal_stops), where terminal_stops maps each terminal to
+    the stop indices of its TIPLOCs.
+    """
+    locations = load_locations(db_path, days, on_date)
+    connections, stops = build_connections(locations)
+
+    start, end = parse_window(window)
+    # Trains leaving right at the start are never boarded, but still count as services
+    keep = connections["dep"] >= start
+    if horizon is not None:
+        keep &= connections["dep"] <= end + horizon
+    connections = connections[keep].reset_index(drop=True)
+    # Renumber the trips left, as the scan keeps a row per trip and query
+    connections["trip"] = pd.factorize(connections["trip"])[0]
+
+    # Which stops each terminal's TIPLOCs map to
+    names = locations.drop_duplicates("tiploc_code").set_index("tiploc_code")["stop_name"]
+    stop_index = {name: i for i, name in enumerate(stops)}
+    terminal_stops = {}
+    for terminal, tiplocs in terminal_tiplocs.items():
+        stop_ids = sorted({stop_index[names[code]] for code in tiplocs if code in names.index})
+        if stop_ids:
+            terminal_stops[terminal] = stop_ids
+    return connections, stops, terminal_stops
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expected travel times from each terminal allowing changes of train.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--window", default=DEFAULT_WINDOW, help="Departure window HH:MM-HH:MM")
+    parser.add_argument("--days", default=DEFAULT_DAYS, help="Days a train must run on, e.g. tue, mon,tue or all")
+    parser.add_argument("--date", help="Calendar date YYYY-MM-DD, resolving STP overlays; replaces --days")
+    parser.add_argument("--step", type=int, default=DEFAULT_STEP, help="Minutes between time points")
+    parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON,
+                        help="Only scan connections leaving up to this many minutes after the window closes; "
+                             "quicker, but journeys arriving later go uncounted (default: scan them all)")
+    parser.add_argument("--min-change", type=int, default=DEFAULT_MIN_CHANGE,
+                        help="Minimum minutes to change trains at a station")
+    parser.add_argument("--change-times", help="CSV of stop,minutes overriding --min-change for given stations")
+    parser.add_argument("--cutoff", type=float, help="Drop stops whose expected time exceeds this many minutes")
+    parser.add_argument("--output", default=SUMMARY_PATH)
+    parser.add_argument("--csv", action="store_true", help="Also write a CSV copy for inspection")
+    args = parser.parse_args()
+    metrics.start_stage("connection_scan")
+
+    overrides = None
+    if args.change_times:
+        overrides = pd.read_csv(args.change_times).set_index("stop")["minutes"].to_dict()
+
+    started = time.perf_counter()
+    with metrics.section("load_network"):
+        connections, stops, terminal_stops = load_network(args.db, args.days, args.window, args.horizon, args.date)
+    print(f"Scanning {len(connections)} connections between {len(stops)} stops...")
+    with metrics.section("scan"):
+        results = profile(connections, stops, terminal_stops, args.window, args.step, args.min_change, overrides)
+    summary = summarise(results, service_counts(connections, stops, terminal_stops, args.window), args.cutoff)
+    metrics.count("connections_in", len(connections))
+    metrics.count("rows_out", len(summary))
+    path = write_frame(summary, args.output, csv=args.csv)
+    if args.horizon is not None:
+        print(f"Note: only connections leaving within {args.horizon} minutes of the window's end were "
+              "scanned; journeys needing later ones are not counted, so samples and expected times may be low")
+    print(f"Done in {time.perf_counter() - started:.1f}s. Saved to {path}")
@@ -3,22 +3,40 @@
 ### Script to create map of London railway stations with commute times ###
 ##########################################################################
 
-import pandas as pd
+import argparse
 import folium
 import os
 from branca.colormap import linear
+import metrics
+from frames import read_frame
+from map_layers import StopLayer, isochrone_overlays
+
+parser = argparse.ArgumentParser(description="Build the HTML commuter map from geocoded travel times.")
+parser.add_argument("--input", default="output/expected_time_to_stops_geocoded.feather",
+                    help="Geocoded output of expected_travel_times.py")
+parser.add_argument("--cutoff", type=float, default=120, help="Leave out stops more than this many minutes away")
+parser.add_argument("--output", default="output/london_commuter_stations.html")
+parser.add_argument("--mode", choices=["markers", "geojson"], default="markers",
+                    help="markers: one marker per stop per terminal layer; geojson: each stop once, "
+                         "with terminal toggling and colouring done in the browser")
+parser.add_argument("--isochrones", action="store_true",
+                    help="Add precomputed travel-time bands from each terminal (see isochrones.py)")
+args = parser.parse_args()
+metrics.start_stage("create_map")
 
 # Load geocoded stop data
-df = pd.read_csv("output/expected_time_to_stops_geocoded.csv")
+df = read_frame(args.input)
 
 # Filter out rows where terminal == stop
-df = df[df['terminal'] != df['stop']]
+df = df[df['terminal'].astype(str) != df['stop'].astype(str)]
 
 # Filter out long travel times
-df = df[df['expected_minutes'] <= 120]
+df = df[df['expected_minutes'] <= args.cutoff]
+metrics.count("rows_in", len(df))
 
 # Set up map centered on London
-m = folium.Map(location=[51.5074, -0.1278], zoom_start=10, tiles="CartoDB positron")
+m = folium.Map(location=[51.5074, -0.1278], zoom_start=10, tiles="CartoDB positron",
+               prefer_canvas=args.mode == "geojson")
 
 # Color scale: green (short) to red (long)
 min_minutes = df['expected_minutes'].min()
@@ -30,14 +48,14 @@ colormap.add_to(m)
 
 # Load terminal names to exclude them from colored dot layer
 try:
-    terminal_names = pd.read_csv("output/london_terminals_geocoded.csv")['terminal'].str.upper().tolist()
+    terminal_names = read_frame("output/london_terminals_geocoded.feather")['terminal'].astype(str).str.upper().tolist()
 except FileNotFoundError:
     terminal_names = []
-    print("Warning: london_terminals_geocoded.csv not found. Skipping terminal exclusion.")
+    print("Warning: london_terminals_geocoded not found. Skipping terminal exclusion.")
 
 # Group by stop: one dot per stop
 grouped = (
-    df.groupby('stop')
+    df.groupby('stop', observed=True)
       .agg({
           'lat': 'first',
           'lon': 'first',
@@ -48,51 +66,66 @@ grouped = (
 )
 
 # Remove terminals from stops layer
-grouped = grouped[~grouped['stop'].str.upper().isin(terminal_names)]
-
-# --- Create one FeatureGroup per terminal ---
-terminal_layers = {}
-for term in sorted(df['terminal'].unique()):
-    terminal_layers[term] = folium.FeatureGroup(name=term)
-
-# Add markers for stops (shared across layers)
-for _, row in grouped.iterrows():
-    lat, lon = row['lat'], row['lon']
-    min_time = min(row['expected_minutes'])
-    color = colormap(min_time)
-
-    # Tooltip text, sorted by expected_minutes
-    lines = [f"<b>{row['stop']}</b>"]
-    pairs = sorted(zip(row['terminal'], row['expected_minutes']), key=lambda x: x[1])
-    for term, mins in pairs:
-        lines.append(f"- {term}: {mins:.1f} min")
-    tooltip = "<br>".join(lines)
-
-    for term in row['terminal']:
-        if term in terminal_layers:
-            marker = folium.CircleMarker(
-                location=(lat, lon),
-                radius=6,
-                popup=folium.Popup(tooltip, max_width=300),
-                tooltip=tooltip,
-                color=color,
-                fill=True,
-                fill_opacity=0.8,
-                fill_color=color
-            )
-            terminal_layers[term].add_child(marker)
-
-
-# Add all terminal layers to the map
-for group in terminal_layers.values():
-    group.add_to(m)
-
-# Add checkbox controls
-folium.LayerControl(collapsed=False).add_to(m)
+grouped = grouped[~grouped['stop'].astype(str).str.upper().isin(terminal_names)]
+metrics.count("stops_out", len(grouped))
+
+# --- Isochrone bands underneath the stops ---
+if args.isochrones:
+    from isochrones import load_isochrones
+    for overlay in isochrone_overlays(load_isochrones(args.input), colormap):
+        overlay.add_to(m)
+
+if args.mode == "geojson":
+    # One feature per stop; the terminal checkboxes live in the page
+    with metrics.section("geojson_layer"):
+        StopLayer(grouped, sorted(df['terminal'].astype(str).unique()), colormap).add_to(m)
+    if args.isochrones:
+        folium.LayerControl(collapsed=False).add_to(m)
+else:
+    # --- Create one FeatureGroup per terminal ---
+    terminal_layers = {}
+    for term in sorted(df['terminal'].unique()):
+        terminal_layers[term] = folium.FeatureGroup(name=term)
+
+    with metrics.section("marker_generation"):
+        # Add markers for stops (shared across layers)
+        for _, row in grouped.iterrows():
+            lat, lon = row['lat'], row['lon']
+            min_time = min(row['expected_minutes'])
+            color = colormap(min_time)
+
+            # Tooltip text, sorted by expected_minutes
+            lines = [f"<b>{row['stop']}</b>"]
+            pairs = sorted(zip(row['terminal'], row['expected_minutes']), key=lambda x: x[1])
+            for term, mins in pairs:
+                lines.append(f"- {term}: {mins:.1f} min")
+            tooltip = "<br>".join(lines)
+
+            for term in row['terminal']:
+                if term in terminal_layers:
+                    marker = folium.CircleMarker(
+                        location=(lat, lon),
+                        radius=6,
+                        popup=folium.Popup(tooltip, max_width=300),
+                        tooltip=tooltip,
+                        color=color,
+                        fill=True,
+                        fill_opacity=0.8,
+                        fill_color=color
+                    )
+                    terminal_layers[term].add_child(marker)
+                    metrics.count("markers_out")
+
+    # Add all terminal layers to the map
+    for group in terminal_layers.values():
+        group.add_to(m)
+
+    # Add checkbox controls
+    folium.LayerControl(collapsed=False).add_to(m)
 
 # --- Add black star markers for London terminals ---
 try:
-    terminals = pd.read_csv("output/london_terminals_geocoded.csv")
+    terminals = read_frame("output/london_terminals_geocoded.feather")
 
     for _, row in terminals.iterrows():
         folium.map.Marker(
@@ -105,12 +138,13 @@ try:
         ).add_to(m)
 
 except FileNotFoundError:
-    print("Warning: london_terminals_geocoded.csv not found. Skipping terminal markers.")
+    print("Warning: london_terminals_geocoded not found. Skipping terminal markers.")
 
 # Save the map
-os.makedirs("output", exist_ok=True)
-m.save("output/london_commuter_stations.html")
-print("Map saved to output/london_commuter_stations.html")
+os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+with metrics.section("save"):
+    m.save(args.output)
+print(f"Map saved to {args.output}")
 
 
 
@@ -5,49 +5,276 @@
 
 import sqlite3
 
-conn = sqlite3.connect("db/timetable.db")
-c = conn.cursor()
-
-# Station reference (TIPLOCs)
-c.execute("""
-CREATE TABLE IF NOT EXISTS tiplocs (
-    tiploc_code TEXT PRIMARY KEY,
-    station_name TEXT
-);
-""")
-
-# Train-level metadata
-c.execute("""
-CREATE TABLE IF NOT EXISTS trains (
-    train_id TEXT PRIMARY KEY,  -- Composite key: uid + stp + start_date
-    train_uid TEXT,
-    stp_indicator TEXT,
-    service_code TEXT,
-    runs_on TEXT,
-    start_date TEXT,
-    end_date TEXT,
-    train_status TEXT,
-    origin TEXT,
-    destination TEXT
-);
-""")
-
-# Each location visited by a train
-c.execute("""
-CREATE TABLE IF NOT EXISTS train_locations (
-    train_id TEXT,
-    seq INTEGER,
-    tiploc_code TEXT,
-    arrival TEXT,
-    departure TEXT,
-    platform TEXT,
-    activity TEXT,
-    PRIMARY KEY (train_id, seq)
-);
-""")
-
-conn.commit()
-conn.close()
-print("Schema created.")
+from calendar_index import encode_calendar
+from time_encoding import encode_time
 
+DB_PATH = "db/timetable.db"
 
+# Tracked in PRAGMA user_version; databases from before versioning report 0
+SCHEMA_VERSION = 5
+
+TABLES = [
+    # Station reference (TIPLOCs). Codes seen only in schedules get a row with no name.
+    """
+    CREATE TABLE IF NOT EXISTS tiplocs (
+        tiploc_id INTEGER PRIMARY KEY,
+        tiploc_code TEXT NOT NULL UNIQUE,
+        station_name TEXT
+    );
+    """,
+    # Train-level metadata; (train_uid, stp_indicator, start_date) identifies a schedule.
+    # STP cancellations ('C') are kept, with no origin, destination or locations.
+    """
+    CREATE TABLE IF NOT EXISTS trains (
+        train_id INTEGER PRIMARY KEY,
+        train_uid TEXT NOT NULL,
+        stp_indicator TEXT NOT NULL,
+        service_code TEXT,
+        runs_on TEXT,
+        start_date TEXT NOT NULL,
+        end_date TEXT,
+        train_status TEXT,
+        origin_id INTEGER,       -- tiplocs.tiploc_id
+        destination_id INTEGER,  -- tiplocs.tiploc_id
+        calendar_start INTEGER,  -- date ordinal of the first bit in calendar
+        calendar BLOB            -- little-endian bitset of the dates the schedule runs on
+    );
+    """,
+    # Each location visited by a train, clustered by train so a schedule is one range read
+    """
+    CREATE TABLE IF NOT EXISTS train_locations (
+        train_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        tiploc_id INTEGER NOT NULL,
+        arrival INTEGER,     -- public arrival, minutes after midnight
+        departure INTEGER,   -- public departure, minutes after midnight
+        platform TEXT,
+        activity TEXT,
+        PRIMARY KEY (train_id, seq)
+    ) WITHOUT ROWID;
+    """,
+    # Extracts applied to the database, so daily updates can be checked for gaps
+    """
+    CREATE TABLE IF NOT EXISTS applied_extracts (
+        id INTEGER PRIMARY KEY,
+        extract_type TEXT,  -- 'full' or 'update'
+        sequence INTEGER,
+        timestamp INTEGER,
+        source TEXT,
+        applied_at TEXT
+    );
+    """,
+    # TIPLOC codes a filtered load kept schedules for; empty when the whole timetable is loaded
+    """
+    CREATE TABLE IF NOT EXISTS ingest_filter (
+        tiploc_code TEXT PRIMARY KEY
+    ) WITHOUT ROWID;
+    """,
+]
+
+# Secondary indexes, dropped during a full load and rebuilt once at the end
+INDEXES = {
+    "idx_trains_key": "CREATE UNIQUE INDEX IF NOT EXISTS idx_trains_key ON trains (train_uid, stp_indicator, start_date)",
+    "idx_train_locations_tiploc": "CREATE INDEX IF NOT EXISTS idx_train_locations_tiploc ON train_locations (tiploc_id)",
+}
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def create_indexes(conn):
+    for sql in INDEXES.values():
+        conn.execute(sql)
+    # Sampled statistics are plenty for the planner and keep this quick on a full timetable
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def drop_indexes(conn):
+    for name in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+
+def create_schema(conn):
+    for sql in TABLES:
+        conn.execute(sql)
+    create_indexes(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+# --- Migrations ---
+def migrate_v1_to_v2(conn):
+    """Rewrite the text-keyed v1 tables onto integer surrogate keys."""
+    c = conn.cursor()
+    for table in ["tiplocs", "trains", "train_locations"]:
+        c.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+
+    # The v2 layout as it stood, so later migrations start from a known shape
+    c.execute("""
+        CREATE TABLE tiplocs (
+            tiploc_id INTEGER PRIMARY KEY,
+            tiploc_code TEXT NOT NULL UNIQUE,
+            station_name TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE trains (
+            train_id INTEGER PRIMARY KEY,
+            train_uid TEXT NOT NULL,
+            stp_indicator TEXT NOT NULL,
+            service_code TEXT,
+            runs_on TEXT,
+            start_date TEXT NOT NULL,
+            end_date TEXT,
+            train_status TEXT,
+            origin_id INTEGER,
+            destination_id INTEGER
+        )
+    """)
+    c.execute("""
+        CREATE TABLE train_locations (
+            train_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            tiploc_id INTEGER NOT NULL,
+            arrival TEXT,
+            departure TEXT,
+            platform TEXT,
+            activity TEXT,
+            PRIMARY KEY (train_id, seq)
+        ) WITHOUT ROWID
+    """)
+
+    # Named TIPLOCs first, then placeholders for codes only schedules mention
+    c.execute("""
+        INSERT INTO tiplocs (tiploc_code, station_name)
+        SELECT tiploc_code, station_name FROM tiplocs_v1 ORDER BY tiploc_code
+    """)
+    c.execute("""
+        INSERT OR IGNORE INTO tiplocs (tiploc_code)
+        SELECT tiploc_code FROM train_locations_v1
+        UNION SELECT origin FROM trains_v1 WHERE origin IS NOT NULL
+        UNION SELECT destination FROM trains_v1 WHERE destination IS NOT NULL
+    """)
+
+    # The v1 rowid becomes the surrogate train_id
+    c.execute("""
+        INSERT INTO trains (
+            train_id, train_uid, stp_indicator, service_code, runs_on,
+            start_date, end_date, train_status, origin_id, destination_id
+        )
+        SELECT t.rowid, t.train_uid, t.stp_indicator, t.service_code, t.runs_on,
+               t.start_date, t.end_date, t.train_status, o.tiploc_id, d.tiploc_id
+        FROM trains_v1 t
+        LEFT JOIN tiplocs o ON o.tiploc_code = t.origin
+        LEFT JOIN tiplocs d ON d.tiploc_code = t.destination
+    """)
+    c.execute("""
+        INSERT INTO train_locations (
+            train_id, seq, tiploc_id, arrival, departure, platform, activity
+        )
+        SELECT t.rowid, tl.seq, tp.tiploc_id, tl.arrival, tl.departure, tl.platform, tl.activity
+        FROM train_locations_v1 tl
+        JOIN trains_v1 t ON t.train_id = tl.train_id
+        JOIN tiplocs tp ON tp.tiploc_code = tl.tiploc_code
+        ORDER BY t.rowid, tl.seq
+    """)
+
+    for table in ["train_locations", "trains", "tiplocs"]:
+        c.execute(f"DROP TABLE {table}_v1")
+    conn.commit()
+
+
+def migrate_v2_to_v3(conn):
+    """Re-encode public arrival/departure times from 'HHMM' text to minutes after midnight."""
+    c = conn.cursor()
+    conn.create_function("encode_time", 1, encode_time, deterministic=True)
+    c.execute("ALTER TABLE train_locations RENAME TO train_locations_v2")
+    c.execute("""
+        CREATE TABLE train_locations (
+            train_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            tiploc_id INTEGER NOT NULL,
+            arrival INTEGER,
+            departure INTEGER,
+            platform TEXT,
+            activity TEXT,
+            PRIMARY KEY (train_id, seq)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        INSERT INTO train_locations (
+            train_id, seq, tiploc_id, arrival, departure, platform, activity
+        )
+        SELECT train_id, seq, tiploc_id, encode_time(arrival), encode_time(departure), platform, activity
+        FROM train_locations_v2
+    """)
+    c.execute("DROP TABLE train_locations_v2")
+    conn.commit()
+
+
+def migrate_v3_to_v4(conn):
+    """Add the per-train operating calendar, built from each schedule's dates and days run."""
+    c = conn.cursor()
+    conn.create_function("encode_calendar_start", 3, lambda *a: encode_calendar(*a)[0], deterministic=True)
+    conn.create_function("encode_calendar_bits", 3, lambda *a: encode_calendar(*a)[1], deterministic=True)
+    c.execute("ALTER TABLE trains ADD COLUMN calendar_start INTEGER")
+    c.execute("ALTER TABLE trains ADD COLUMN calendar BLOB")
+    c.execute("""
+        UPDATE trains SET
+            calendar_start = encode_calendar_start(start_date, end_date, runs_on),
+            calendar = encode_calendar_bits(start_date, end_date, runs_on)
+    """)
+    conn.commit()
+    # Earlier loaders dropped STP cancellations, so reload the timetable to pick those up
+    print("Note: reload the timetable to include STP cancellations in the calendar.")
+
+
+def migrate_v4_to_v5(conn):
+    """Add the (empty) ingest filter table; existing databases hold the whole timetable."""
+    conn.execute("CREATE TABLE IF NOT EXISTS ingest_filter (tiploc_code TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.commit()
+
+
+MIGRATIONS = {
+    1: migrate_v1_to_v2,
+    2: migrate_v2_to_v3,
+    3: migrate_v3_to_v4,
+    4: migrate_v4_to_v5,
+}
+
+
+def migrate(conn):
+    version = schema_version(conn)
+    has_tables = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trains'"
+    ).fetchone()
+
+    # Unversioned databases with tables are the original text-keyed layout
+    if version == 0 and has_tables:
+        version = 1
+
+    migrated = False
+    while 0 < version < SCHEMA_VERSION:
+        print(f"Migrating schema v{version} -> v{version + 1}...")
+        MIGRATIONS[version](conn)
+        version += 1
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        migrated = True
+
+    # Idempotent; also picks up tables added since, such as applied_extracts
+    create_schema(conn)
+    if migrated:
+        conn.execute("VACUUM")
+    return migrated
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB_PATH)
+    migrated = migrate(conn)
+    conn.close()
+    print("Schema migrated." if migrated else "Schema created.")
@@ -3,24 +3,92 @@
 ### This pulls the raw data from national rail ###
 ##################################################
 
+import json
 import os
 import requests
-import json
 from auth import load_credentials, get_token
 
-def download_timetable_zip(token, output_path="data/timetable.zip"):
-    url = "https://opendata.nationalrail.co.uk/api/staticfeeds/3.0/timetable"
-    headers = {"X-Auth-Token": token}
+TIMETABLE_URL = "https://opendata.nationalrail.co.uk/api/staticfeeds/3.0/timetable"
+CHUNK_SIZE = 1024 * 1024
+
+
+def load_download_meta(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_download_meta(meta_path, response, complete):
+    meta = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "complete": complete,
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+
+def download_timetable_zip(token, output_path="data/timetable.zip", url=TIMETABLE_URL,
+                           chunk_size=CHUNK_SIZE, max_attempts=5):
+    """Stream the timetable ZIP to disk, resuming partial downloads and skipping unchanged feeds.
+
+    The bytes go to ``<output_path>.part`` and are renamed into place once complete. The
+    validators (ETag / Last-Modified) of the download are kept in ``<output_path>.meta.json``.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    part_path = output_path + ".part"
+    meta_path = output_path + ".meta.json"
+
+    for attempt in range(1, max_attempts + 1):
+        meta = load_download_meta(meta_path)
+        validator = meta.get("etag") or meta.get("last_modified")
+        headers = {"X-Auth-Token": token}
+        offset = 0
+
+        if os.path.exists(part_path) and validator and not meta.get("complete"):
+            # Resume, but only if the feed is still the one we started downloading
+            offset = os.path.getsize(part_path)
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        elif os.path.exists(output_path) and meta.get("complete"):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+                if response.status_code == 304:
+                    print(f"Timetable unchanged since last download; keeping {output_path}")
+                    return output_path
+
+                content_range = response.headers.get("Content-Range", "")
+                if response.status_code == 206 and content_range.startswith(f"bytes {offset}-"):
+                    mode = "ab"
+                    print(f"Resuming download at byte {offset}")
+                elif response.status_code == 200:
+                    mode = "wb"
+                    save_download_meta(meta_path, response, complete=False)
+                else:
+                    raise Exception(f"Download failed: {response.status_code} {response.text}")
+
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+
+                os.replace(part_path, output_path)
+                save_download_meta(meta_path, response, complete=True)
+                print(f"Downloaded timetable ZIP to {output_path}")
+                return output_path
+
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            # Whatever reached the .part file is kept and picked up by the next attempt
+            print(f"Download interrupted (attempt {attempt}/{max_attempts}): {e}")
 
-    response = requests.get(url, headers=headers)
+    raise Exception(f"Download failed after {max_attempts} attempts")
 
-    if response.status_code == 200:
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "wb") as f:
-            f.write(response.content)
-        print(f"Downloaded timetable ZIP to {output_path}")
-    else:
-        raise Exception(f"Download failed: {response.status_code} {response.text}")
 
 if __name__ == "__main__":
     creds = load_credentials()
@@ -3,25 +3,45 @@
 ### Script to calculate expected times from terminal to all destinations ###
 ############################################################################
 
+import argparse
+import contextlib
+import hashlib
+import itertools
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing.shared_memory import SharedMemory
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+import metrics
+from calendar_index import CalendarIndex
+from frames import FrameWriter, read_frame, resolve_frame, write_frame
+from time_encoding import format_minutes
 
-# --- Load and prepare data ---
-df = pd.read_csv("output/london_trains.csv", parse_dates=["arr_time", "dep_time", "origin_time"])
+LONDON_TRAINS_PATH = "output/london_trains.feather"
+DB_PATH = "db/timetable.db"
+CACHE_DIR = "output/cache"
+RESULTS_PATH = "output/results_df.feather"
+SUMMARY_PATH = "output/expected_times_to_stops.feather"
 
-# --- Filter for Tuesday services ---
-df = df[df["runs_tue"] == 1].copy()
+# Bump when the layout of the cached terminal pairs changes
+PAIRS_CACHE_VERSION = 3
 
-# --- Adjust for post-midnight arrivals ---
-df["arr_time"] = np.where(
-    (df["arr_time"].notna()) & (df["origin_time"].notna()) & (df["arr_time"] < df["origin_time"]),
-    df["arr_time"] + pd.Timedelta(days=1),
-    df["arr_time"]
-)
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# Defaults reproduce the original Tuesday evening peak analysis
+DEFAULT_WINDOW = "17:00-19:00"
+DEFAULT_DAYS = "tue"
+DEFAULT_STEP = 1
+
+# Wide enough to hold any clock minute (including post-midnight arrivals) when
+# combined with a stop index into a single sortable key
+MINUTE_SPAN = 4096
 
-# --- Define time points from 17:00 to 19:00 ---
-time_points = [datetime(1900, 1, 1, 17, 0) + timedelta(minutes=i) for i in range(120)]
+# Time points swept at once; bounds the rows held per terminal whatever the window length
+TIME_POINTS_PER_CHUNK = 120
 
 # --- Define terminal TIPLOCs ---
 terminal_tiplocs = {
@@ -40,60 +60,566 @@ terminal_tiplocs = {
     'LONDON WATERLOO': ['WATR', 'WATRLMN', 'WATRLOO', 'WATRLOW']
 }
 
-all_results = []
 
-# --- Loop over each terminal ---
-for terminal, tiplocs in terminal_tiplocs.items():
+# --- Sweep engine ---
+def terminal_pairs(df, tiplocs):
+    """Every (terminal departure, later arrival) pair on the same train, in merge order."""
     # Get terminal departures based on TIPLOCs
     term_rows = df[df["tiploc_code"].isin(tiplocs) & df["dep_time"].notna()][
         ["train_id", "dep_time", "seq"]
     ].rename(columns={"dep_time": "terminal_dep_time", "seq": "terminal_seq"})
-    term_rows["terminal"] = terminal
 
-    # Merge terminal info into full dataset
-    merged = df.merge(term_rows, on="train_id")
+    # Merge terminal info into just the columns the pairs need
+    merged = df[["train_id", "seq", "stop_name", "arr_time", "runs"]].merge(term_rows, on="train_id")
 
     # Filter for locations *after* the terminal departure with valid arrival time
     merged = merged[(merged["seq"] > merged["terminal_seq"]) & merged["arr_time"].notna()]
+    return merged[["train_id", "terminal_dep_time", "stop_name", "arr_time", "runs"]].reset_index(drop=True)
 
-    if merged.empty:
-        continue
 
-    for t in time_points:
-        eligible = merged[merged["terminal_dep_time"] > t]
-        if eligible.empty:
-            continue
+def soonest_arrivals(pairs, time_points):
+    """For each time point t and stop, the soonest arrival on a train leaving the terminal after t.
+
+    Equivalent to filtering pairs on terminal_dep_time > t and taking the per-stop idxmin of
+    arr_time for every t (ties going to the earliest pair), but done in one pass: pairs are
+    sorted by (stop, departure), a reverse cumulative minimum gives the best arrival among all
+    later departures, and each (t, stop) lookup is a single searchsorted.
+    """
+    pairs = pairs[pairs["stop_name"].notna()].reset_index(drop=True)
+    columns = ["stop_name", "elapsed_minutes", "minute_block", "train_id", "terminal_dep_time", "arr_time"]
+    if pairs.empty:
+        return pd.DataFrame(columns=columns)
+
+    n = len(pairs)
+    stop_codes, stops = pd.factorize(pairs["stop_name"], sort=True)
+    stops = np.asarray(stops, dtype=object)
+    dep = pairs["terminal_dep_time"].to_numpy(np.int64)
+    arr = pairs["arr_time"].to_numpy(np.int64)
 
-        eligible = eligible.copy()
-        eligible["elapsed_minutes"] = (eligible["arr_time"] - t).dt.total_seconds() / 60
-        eligible["minute_block"] = t.strftime("%H:%M")
-
-        # Keep the soonest arrival per stop
-        idx = eligible.groupby("stop_name")["arr_time"].idxmin()
-        soonest = eligible.loc[idx, [
-            "terminal", "stop_name", "elapsed_minutes", "minute_block", "train_id",
-            "terminal_dep_time", "arr_time"
-        ]]
-        all_results.append(soonest)
-
-# --- Combine and save all results ---
-results_df = pd.concat(all_results, ignore_index=True)
-results_df.to_csv("output/results_df.csv", index=False)
-
-# --- Summarize ---
-summary = (
-    results_df.groupby(["terminal", "stop_name"])
-    .agg(
-        expected_minutes=("elapsed_minutes", "mean"),
-        samples=("elapsed_minutes", "count")
+    order = np.lexsort((dep, stop_codes))
+    sorted_stops = stop_codes[order]
+    sorted_keys = sorted_stops * MINUTE_SPAN + dep[order]
+
+    # arr * n + row orders by arrival, then by original row as the tie-break
+    best = arr[order] * n + order
+    suffix_best = (
+        pd.Series(best[::-1]).groupby(sorted_stops[::-1]).cummin().to_numpy()[::-1]
     )
-    .round(1)
-    .reset_index()
-    .rename(columns={"stop_name": "stop"})
+
+    stop_index = np.arange(len(stops))
+    stop_end = np.searchsorted(sorted_keys, (stop_index + 1) * MINUTE_SPAN, side="left")
+
+    t = np.asarray(time_points, dtype=np.int64)
+    first_later = np.searchsorted(sorted_keys, stop_index[None, :] * MINUTE_SPAN + t[:, None], side="right")
+    t_idx, s_idx = np.nonzero(first_later < stop_end[None, :])
+
+    row = suffix_best[first_later[t_idx, s_idx]] % n
+    labels = np.array([format_minutes(m) for m in t])
+    return pd.DataFrame({
+        "stop_name": stops[s_idx],
+        "elapsed_minutes": (arr[row] - t[t_idx]).astype(float),
+        "minute_block": labels[t_idx],
+        "train_id": pairs["train_id"].to_numpy()[row],
+        "terminal_dep_time": dep[row],
+        "arr_time": arr[row],
+    })
+
+
+def time_chunks(time_points, min_chunks=1):
+    """The time points in consecutive runs of at most TIME_POINTS_PER_CHUNK (and at least min_chunks runs)."""
+    n = max(min_chunks, -(-len(time_points) // TIME_POINTS_PER_CHUNK))
+    n = max(1, min(n, len(time_points)))
+    return [[int(t) for t in chunk] for chunk in np.array_split(np.asarray(time_points), n)]
+
+
+# --- Streaming summary ---
+# Histogram keys are stop * HIST_SPAN + MINUTE_SPAN + elapsed minutes, which fits any
+# elapsed time between two clock minutes (a negative one included)
+HIST_SPAN = 2 * MINUTE_SPAN
+
+
+def _grow(a, n):
+    return np.pad(a, (0, n - len(a)))
+
+
+class TerminalSummary:
+    """Per-stop statistics of one terminal's soonest-arrival samples, added a chunk at a time.
+
+    Elapsed times are whole minutes, so each stop keeps a histogram (sorted keys and their
+    counts) rather than its samples: the mean and the exact percentiles come out as they
+    would from the full rows, in memory that grows with the spread of times, not the window.
+    """
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self.stop_ids = {}
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.wait = np.zeros(0)
+
+    def add(self, soonest):
+        if soonest.empty:
+            return
+        codes, names = pd.factorize(soonest["stop_name"])
+        ids = np.array([self.stop_ids.setdefault(name, len(self.stop_ids)) for name in names], dtype=np.int64)[codes]
+        elapsed = soonest["elapsed_minutes"].to_numpy(np.int64)
+        # The time point is the arrival less the elapsed time; the wait runs from it to departure
+        wait = soonest["terminal_dep_time"].to_numpy(np.int64) - (soonest["arr_time"].to_numpy(np.int64) - elapsed)
+        self.wait = _grow(self.wait, len(self.stop_ids)) + np.bincount(ids, weights=wait, minlength=len(self.stop_ids))
+
+        keys, counts = np.unique(ids * HIST_SPAN + MINUTE_SPAN + elapsed, return_counts=True)
+        self.keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts])).astype(np.int64)
+
+    def summary(self):
+        """One row per stop: expected (mean), p50, p90 and max minutes, and the mean wait and time on board."""
+        n_stops = len(self.stop_ids)
+        ids = self.keys // HIST_SPAN
+        values = self.keys % HIST_SPAN - MINUTE_SPAN
+        samples = np.bincount(ids, weights=self.counts, minlength=n_stops)
+        total = np.bincount(ids, weights=values * self.counts, minlength=n_stops)
+        # Keys are sorted by stop, so a stop's samples are one run of the cumulative counts
+        cumulative = np.cumsum(self.counts)
+        before = np.cumsum(samples) - samples
+
+        def quantile(q):
+            # Linear interpolation between ranks, as np.quantile does
+            position = (samples - 1) * q
+            lower = np.floor(position)
+            low = values[np.searchsorted(cumulative, before + lower, side="right")]
+            high = values[np.searchsorted(cumulative, before + np.minimum(lower + 1, samples - 1), side="right")]
+            return low + (high - low) * (position - lower)
+
+        mean = total / np.maximum(samples, 1)
+        mean_wait = self.wait / np.maximum(samples, 1)
+        return pd.DataFrame({
+            "terminal": self.terminal,
+            "stop": np.array(list(self.stop_ids), dtype=object),
+            "expected_minutes": np.round(mean, 1),
+            "samples": samples.astype(np.int64),
+            "p50_minutes": np.round(quantile(0.5), 1),
+            "p90_minutes": np.round(quantile(0.9), 1),
+            "max_minutes": quantile(1.0),
+            "mean_wait_minutes": np.round(mean_wait, 1),
+            "mean_in_train_minutes": np.round(mean - mean_wait, 1),
+        })
+
+
+# --- Prepared terminal pairs ---
+def load_trains(path=LONDON_TRAINS_PATH):
+    # arr_time, dep_time and origin_time are minutes after midnight
+    day_columns = [f"runs_{day}" for day in DAY_NAMES]
+    df = read_frame(path, columns=["train_id", "seq", "tiploc_code", "stop_name", "arr_time", "dep_time",
+                                   "origin_time"] + day_columns)
+
+    # --- Adjust for post-midnight arrivals ---
+    df["arr_time"] = np.where(
+        (df["arr_time"].notna()) & (df["origin_time"].notna()) & (df["arr_time"] < df["origin_time"]),
+        df["arr_time"] + 1440,
+        df["arr_time"]
+    )
+
+    # Days of operation as a bitmask (bit 0 = Monday) so any day set is one AND
+    runs = np.zeros(len(df), dtype=np.uint8)
+    for i, col in enumerate(day_columns):
+        runs |= df[col].fillna(0).to_numpy(np.uint8) << i
+    return df.drop(columns=day_columns + ["origin_time"]).assign(runs=runs)
+
+
+def prepare_terminal_pairs(df):
+    """Midnight-adjusted departure/arrival pairs for every terminal, for all days of the week."""
+    frames = []
+    for terminal, tiplocs in terminal_tiplocs.items():
+        pairs = terminal_pairs(df, tiplocs)
+        pairs.insert(0, "terminal", terminal)
+        frames.append(pairs)
+    pairs = pd.concat(frames, ignore_index=True)
+    pairs["terminal"] = pairs["terminal"].astype(pd.CategoricalDtype(list(terminal_tiplocs)))
+    pairs["train_id"] = pairs["train_id"].astype(np.int32)
+    # Clock minutes, up to two days' worth after the midnight adjustment
+    pairs["terminal_dep_time"] = pairs["terminal_dep_time"].astype(np.int16)
+    pairs["arr_time"] = pairs["arr_time"].astype(np.int16)
+    pairs["runs"] = pairs["runs"].astype(np.uint8)
+    return pairs
+
+
+# Terminal departures joined to every later public arrival of the same train. The few
+# terminal departures are gathered first through the tiploc_id index (with each train's
+# origin time and days run), then each train's later calls are a range scan of the
+# (train_id, seq) primary key, so only the pairs themselves leave SQLite. CROSS JOIN pins
+# that join order; left to itself the planner walks every location before the terminal
+# list. Rows come out in the order the pandas merge produced them, which the sweep's
+# tie-break relies on.
+TERMINAL_PAIRS_QUERY = """
+WITH terminal_deps AS MATERIALIZED (
+    SELECT
+        tt.terminal_order,
+        d.train_id,
+        d.seq,
+        d.departure,
+        -- Departure from the originating location, else from the first call
+        COALESCE(
+            (SELECT o.departure FROM train_locations o
+             WHERE o.train_id = d.train_id AND o.activity = 'LO' ORDER BY o.seq LIMIT 1),
+            (SELECT o.departure FROM train_locations o
+             WHERE o.train_id = d.train_id ORDER BY o.seq LIMIT 1)
+        ) AS origin_time,
+        {runs} AS runs
+    FROM temp.terminal_tiplocs tt
+    CROSS JOIN tiplocs tp ON tp.tiploc_code = tt.tiploc_code
+    CROSS JOIN train_locations d ON d.tiploc_id = tp.tiploc_id
+    JOIN trains t ON t.train_id = d.train_id
+    JOIN tiplocs origin_station ON origin_station.tiploc_id = t.origin_id
+    JOIN tiplocs dest_station ON dest_station.tiploc_id = t.destination_id
+    WHERE d.departure IS NOT NULL
+      AND origin_station.station_name IS NOT NULL
+      AND dest_station.station_name IS NOT NULL
 )
-summary.to_csv("output/expected_times_to_stops.csv", index=False)
+SELECT
+    td.terminal_order,
+    td.train_id,
+    td.departure AS terminal_dep_time,
+    a.tiploc_id,
+    CASE WHEN a.arrival < td.origin_time THEN a.arrival + 1440 ELSE a.arrival END AS arr_time,
+    td.runs
+FROM terminal_deps td
+CROSS JOIN train_locations a ON a.train_id = td.train_id AND a.seq > td.seq
+WHERE a.arrival IS NOT NULL
+ORDER BY td.terminal_order, td.train_id, a.seq, td.seq
+"""
+
+# Rows fetched per chunk while reading pairs from SQLite
+QUERY_CHUNK_ROWS = 500_000
+
+
+def query_terminal_pairs(db_path=DB_PATH):
+    """The same frame as prepare_terminal_pairs, computed by a self-join inside SQLite.
+
+    Only integers cross over from SQLite; terminals and stop names become categoricals by
+    code lookups on this side.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TEMP TABLE terminal_tiplocs (terminal_order INTEGER, tiploc_code TEXT)")
+    conn.executemany("INSERT INTO temp.terminal_tiplocs VALUES (?, ?)", [
+        (i, code) for i, codes in enumerate(terminal_tiplocs.values()) for code in codes
+    ])
+
+    # tiploc_id -> code into the sorted station names (-1 for unnamed TIPLOCs)
+    tiplocs = pd.read_sql_query("SELECT tiploc_id, station_name FROM tiplocs", conn)
+    stop_codes, stop_names = pd.factorize(tiplocs["station_name"], sort=True)
+    name_code = np.full(tiplocs["tiploc_id"].max() + 1 if len(tiplocs) else 1, -1, dtype=np.int32)
+    name_code[tiplocs["tiploc_id"].to_numpy()] = stop_codes
+    stop_dtype = pd.CategoricalDtype(stop_names)
+    terminal_dtype = pd.CategoricalDtype(list(terminal_tiplocs))
+
+    runs = " | ".join(f"((substr(t.runs_on, {i + 1}, 1) = '1') << {i})" for i in range(len(DAY_NAMES)))
+    columns = ["terminal_order", "train_id", "terminal_dep_time", "tiploc_id", "arr_time", "runs"]
+    frames = []
+    chunks = pd.read_sql_query(TERMINAL_PAIRS_QUERY.format(runs=runs), conn, chunksize=QUERY_CHUNK_ROWS)
+    for chunk in itertools.chain(chunks, [pd.DataFrame(columns=columns)]):
+        frames.append(pd.DataFrame({
+            "terminal": pd.Categorical.from_codes(chunk["terminal_order"].to_numpy(np.int8), dtype=terminal_dtype),
+            "train_id": chunk["train_id"].to_numpy(np.int32),
+            "terminal_dep_time": chunk["terminal_dep_time"].to_numpy(np.int16),
+            "stop_name": pd.Categorical.from_codes(name_code[chunk["tiploc_id"].to_numpy(np.int64)], dtype=stop_dtype),
+            "arr_time": chunk["arr_time"].to_numpy(np.int16),
+            "runs": chunk["runs"].to_numpy(np.uint8),
+        }))
+    conn.close()
+    return pd.concat(frames, ignore_index=True)
+
+
+def _cache_path(path, cache_dir):
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{PAIRS_CACHE_VERSION}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"terminal_pairs_{digest}.feather")
+
+
+def load_terminal_pairs(path=None, cache_dir=CACHE_DIR, db_path=DB_PATH):
+    """Prepared terminal pairs, reusing the on-disk cache while the source is unchanged.
+
+    Pairs come straight from the database unless path names a london_trains extract
+    from get_london_terminal_services.py.
+    """
+    source = resolve_frame(path) if path else db_path
+    cache_path = _cache_path(source, cache_dir) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        print(f"Using cached terminal pairs from {cache_path}")
+        return read_frame(cache_path)
+
+    with metrics.section("load_pairs"):
+        pairs = prepare_terminal_pairs(load_trains(path)) if path else query_terminal_pairs(db_path)
+    if cache_path:
+        write_frame(pairs, cache_path)
+    return pairs
+
+
+# --- Parallel fan-out ---
+# Pair columns shared with the worker processes; stop names go as category codes. keep marks
+# the pairs in the current run's day set or date.
+SHARED_COLUMNS = [("train_id", np.int32), ("terminal_dep_time", np.int16), ("stop_name", np.int32),
+                  ("arr_time", np.int16), ("keep", np.bool_)]
+
+# Time-point chunks per worker per run, so large terminals do not finish last on one core
+CHUNKS_PER_WORKER = 2
+
+# Set in each worker process by _attach_pairs
+_shared = None
+
+
+def _shared_arrays(buf, n):
+    arrays, offset = {}, 0
+    for name, dtype in SHARED_COLUMNS:
+        arrays[name] = np.ndarray(n, dtype=dtype, buffer=buf, offset=offset)
+        offset += n * np.dtype(dtype).itemsize
+    return arrays, offset
+
+
+def _attach_pairs(memory_name, n, stop_dtype, bounds):
+    global _shared
+    memory = SharedMemory(name=memory_name)
+    arrays, _ = _shared_arrays(memory.buf, n)
+    _shared = {"memory": memory, "arrays": arrays, "stop_dtype": stop_dtype, "bounds": bounds}
+
+
+def _soonest_chunk(terminal_order, time_points):
+    """soonest_arrivals for one terminal and some time points, from the shared pairs."""
+    lo, hi = _shared["bounds"][terminal_order], _shared["bounds"][terminal_order + 1]
+    arrays = {name: a[lo:hi] for name, a in _shared["arrays"].items()}
+    keep = arrays["keep"]
+    pairs = pd.DataFrame({
+        "train_id": arrays["train_id"][keep],
+        "terminal_dep_time": arrays["terminal_dep_time"][keep],
+        "stop_name": pd.Categorical.from_codes(arrays["stop_name"][keep], dtype=_shared["stop_dtype"]),
+        "arr_time": arrays["arr_time"][keep],
+    })
+    return soonest_arrivals(pairs, time_points)
+
+
+class TerminalPool:
+    """Worker processes for the per-terminal sweeps, reading the pairs from shared memory.
+
+    The pairs are copied once into a shared block, grouped by terminal in their original
+    order (which the sweep's tie-break relies on), so each task carries only a terminal and
+    some of its time points. Results come back in terminal and time order.
+    """
+
+    def __init__(self, pairs, workers):
+        terminal_codes = pd.Categorical(pairs["terminal"], categories=list(terminal_tiplocs)).codes
+        stops = pd.Categorical(pairs["stop_name"])
+        self.order = np.argsort(terminal_codes, kind="stable")
+        self.workers = workers
+        n = len(pairs)
+
+        self.memory = SharedMemory(create=True, size=max(1, sum(n * np.dtype(d).itemsize for _, d in SHARED_COLUMNS)))
+        self.arrays, _ = _shared_arrays(self.memory.buf, n)
+        self.arrays["train_id"][:] = pairs["train_id"].to_numpy(np.int32)[self.order]
+        self.arrays["terminal_dep_time"][:] = pairs["terminal_dep_time"].to_numpy(np.int16)[self.order]
+        self.arrays["stop_name"][:] = stops.codes[self.order]
+        self.arrays["arr_time"][:] = pairs["arr_time"].to_numpy(np.int16)[self.order]
+        # Row range of each terminal, in terminal_tiplocs order
+        self.bounds = np.searchsorted(terminal_codes[self.order], np.arange(len(terminal_tiplocs) + 1))
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_attach_pairs,
+                                        initargs=(self.memory.name, n, stops.dtype, self.bounds))
+
+    def soonest_arrivals(self, keep, time_points):
+        """(terminal, soonest_arrivals frame) for each terminal and chunk of time points, in the
+        order the serial loop gives them, for the pairs marked in keep."""
+        # Workers only read the block while a run is in flight, so it is safe to rewrite here
+        self.arrays["keep"][:] = keep[self.order]
+        chunks = time_chunks(time_points, -(-self.workers * CHUNKS_PER_WORKER // len(terminal_tiplocs)))
+        terminals = list(terminal_tiplocs)
+        tasks = [(t, c) for t in range(len(terminals)) if self.bounds[t] < self.bounds[t + 1]
+                 for c in range(len(chunks))]
+        # Largest terminals first to even out the finish, by the rows kept for this run
+        kept = np.r_[0, np.cumsum(self.arrays["keep"], dtype=np.int64)]
+        sizes = kept[self.bounds[1:]] - kept[self.bounds[:-1]]
+        queue = deque(sorted(tasks, key=lambda task: -sizes[task[0]]))
+
+        # Results are handed on in terminal order, with at most workers * 2 chunks submitted and
+        # not yet handed on, so they cannot pile up ahead of the summary. When the next one due
+        # has not been reached in the queue it is submitted out of turn.
+        futures = {}
+        for task in tasks:
+            while queue and len(futures) < self.workers * 2:
+                queued = queue.popleft()
+                # Tasks before this one were submitted out of turn and already handed on
+                if queued not in futures and queued >= task:
+                    futures[queued] = self.pool.submit(_soonest_chunk, queued[0], chunks[queued[1]])
+            if task not in futures:
+                futures[task] = self.pool.submit(_soonest_chunk, task[0], chunks[task[1]])
+            yield terminals[task[0]], futures.pop(task).result()
+
+    def close(self):
+        self.pool.shutdown()
+        self.arrays = None
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Analysis runs ---
+def parse_window(window):
+    """'17:00-19:00' -> (1020, 1140) in minutes after midnight, end exclusive."""
+    start, end = window.split("-")
+    to_minutes = lambda hhmm: int(hhmm.split(":")[0]) * 60 + int(hhmm.split(":")[1])
+    start, end = to_minutes(start), to_minutes(end)
+    if end <= start:
+        raise ValueError(f"Window {window} must end after it starts")
+    return start, end
+
+
+def parse_days(days):
+    """'tue' or 'mon,tue' or 'all' -> bitmask matching the runs column."""
+    names = DAY_NAMES if days == "all" else [d.strip().lower()[:3] for d in days.split(",")]
+    mask = 0
+    for name in names:
+        if name not in DAY_NAMES:
+            raise ValueError(f"Unknown day {name!r}; use {', '.join(DAY_NAMES)} or 'all'")
+        mask |= 1 << DAY_NAMES.index(name)
+    return mask
+
+
+def iter_soonest_arrivals(pairs, time_points):
+    """(terminal, soonest_arrivals frame) for each terminal and chunk of time points."""
+    for terminal in terminal_tiplocs:
+        terminal_pairs = pairs[pairs["terminal"] == terminal]
+        if terminal_pairs.empty:
+            continue
+        for chunk in time_chunks(time_points):
+            yield terminal, soonest_arrivals(terminal_pairs, chunk)
+
+
+def detail_rows(terminal, soonest):
+    """Soonest-arrival rows as results_df has them, with clock times as 1900-01-01 timestamps."""
+    rows = soonest.copy()
+    rows.insert(0, "terminal", terminal)
+    for col in ["terminal_dep_time", "arr_time"]:
+        rows[col] = pd.Timestamp(1900, 1, 1) + pd.to_timedelta(rows[col], unit="min")
+    return rows
+
+
+def service_counts(pairs, keep, start, end):
+    """Trains leaving each terminal within the window that call at each stop."""
+    dep = pairs["terminal_dep_time"].to_numpy()
+    in_window = pairs[keep & (dep >= start) & (dep < end)]
+    return (
+        in_window.groupby([in_window["terminal"].astype(str), in_window["stop_name"].astype(str)])["train_id"]
+        .nunique()
+        .rename("services")
+        .rename_axis(["terminal", "stop"])
+        .reset_index()
+    )
+
+
+def expected_travel_times(pairs, window=DEFAULT_WINDOW, days=DEFAULT_DAYS, step=DEFAULT_STEP, cutoff=None,
+                          running=None, pool=None, detail=None):
+    """Per-stop summary of the soonest arrivals at every time point in the window.
+
+    Trains count if they run on any of the given days, or, when running is given (the
+    train_ids operating on a calendar date), if they are among those. Stops whose expected
+    time exceeds the cutoff (in minutes) are dropped from the summary. A TerminalPool built
+    on the same pairs spreads the terminals over its processes, with identical results.
+
+    The soonest arrivals are summarised a chunk of time points at a time and then dropped,
+    unless detail (a FrameWriter) is given to receive them as they are produced.
+    """
+    start, end = parse_window(window)
+    time_points = list(range(start, end, step))
+    if running is not None:
+        keep = pairs["train_id"].isin(running).to_numpy()
+    else:
+        keep = ((pairs["runs"] & parse_days(days)) != 0).to_numpy()
+
+    summaries = {}
+    with metrics.section("terminal_loop"):
+        chunks = (pool.soonest_arrivals(keep, time_points) if pool is not None
+                  else iter_soonest_arrivals(pairs[keep], time_points))
+        for terminal, soonest in chunks:
+            summaries.setdefault(terminal, TerminalSummary(terminal)).add(soonest)
+            if detail is not None and not soonest.empty:
+                detail.write(detail_rows(terminal, soonest))
+
+    # --- Summarize ---
+    summary = pd.concat([s.summary() for s in summaries.values()] or [TerminalSummary("").summary()],
+                        ignore_index=True)
+    summary = (
+        summary.merge(service_counts(pairs, keep, start, end), on=["terminal", "stop"], how="left")
+        .fillna({"services": 0})
+        .astype({"services": np.int64})
+        .sort_values(["terminal", "stop"], ignore_index=True)
+    )
+    if cutoff is not None:
+        summary = summary[summary["expected_minutes"] <= cutoff].reset_index(drop=True)
+    return summary
+
+
+def run_suffix(window, days):
+    return f"_{days.replace(',', '-')}_{window.replace(':', '').replace('-', '_')}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expected travel times from each London terminal to every stop.")
+    parser.add_argument("--input", help="Build pairs from this get_london_terminal_services.py output "
+                                         f"(e.g. {LONDON_TRAINS_PATH}) instead of querying --db")
+    parser.add_argument("--window", action="append",
+                        help=f"Departure window HH:MM-HH:MM, repeatable (default {DEFAULT_WINDOW})")
+    parser.add_argument("--days", action="append",
+                        help=f"Days a train must run on, e.g. tue, mon,tue or all; repeatable (default {DEFAULT_DAYS})")
+    parser.add_argument("--date", action="append",
+                        help="Calendar date YYYY-MM-DD, resolving STP overlays and cancellations; "
+                             "repeatable, replaces --days")
+    parser.add_argument("--db", default=DB_PATH, help="Timetable database")
+    parser.add_argument("--step", type=int, default=DEFAULT_STEP, help="Minutes between time points")
+    parser.add_argument("--cutoff", type=float, help="Drop stops whose expected time exceeds this many minutes")
+    parser.add_argument("--no-cache", action="store_true", help="Rebuild the prepared terminal pairs")
+    parser.add_argument("--csv", action="store_true", help="Also write CSV copies of the outputs for inspection")
+    parser.add_argument("--detail", action="store_true",
+                        help=f"Also write the soonest arrival at every time point (zstd-compressed, to {RESULTS_PATH})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes sharing the terminals; 1 runs serially, 0 uses every CPU core")
+    args = parser.parse_args()
+    metrics.start_stage("travel_times")
+
+    windows = args.window or [DEFAULT_WINDOW]
+    day_sets = args.days or [DEFAULT_DAYS]
+
+    # Load once, then run every window/day combination against the same prepared pairs
+    pairs = load_terminal_pairs(args.input, cache_dir=None if args.no_cache else CACHE_DIR, db_path=args.db)
+    running_on = {}
+    if args.date:
+        # A date picks its trains through the calendar rather than the weekly flags
+        conn = sqlite3.connect(args.db)
+        calendar = CalendarIndex.from_db(conn)
+        conn.close()
+        running_on = {d: calendar.running_on(date.fromisoformat(d)) for d in args.date}
+        day_sets = args.date
+    runs = [(window, days) for window in windows for days in day_sets]
+    metrics.count("pairs_in", len(pairs))
+
+    workers = args.workers or os.cpu_count()
+    outputs = []
+    with TerminalPool(pairs, workers) if workers > 1 else contextlib.nullcontext() as pool:
+        for window, days in runs:
+            # A single run keeps the standard file names that the later stages read
+            suffix = run_suffix(window, days) if len(runs) > 1 else ""
+            detail_path = RESULTS_PATH.replace(".feather", f"{suffix}.feather")
+            with FrameWriter(detail_path, args.csv) if args.detail else contextlib.nullcontext() as detail:
+                summary = expected_travel_times(pairs, window, days, args.step, args.cutoff,
+                                                running=running_on.get(days), pool=pool, detail=detail)
+
+            metrics.count("results_out", int(summary["samples"].sum()))
+            metrics.count("rows_out", len(summary))
+            if detail is not None and detail.rows:
+                outputs.append(detail.path)
+            outputs.append(write_frame(summary, SUMMARY_PATH.replace(".feather", f"{suffix}.feather"), args.csv))
 
-# --- Done ---
-print("Done. Outputs saved to:")
-print(" - output/results_df.csv")
-print(" - output/expected_times_to_stops.csv")
+    print("Done. Outputs saved to:")
+    for path in outputs:
+        print(f" - {path}")
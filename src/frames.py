@@ -0,0 +1,92 @@
+
+##########################################################################
+### Columnar hand-off files between pipeline stages (Feather with CSV) ###
+##########################################################################
+
+import os
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+FRAME_SUFFIX = ".feather"
+
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_RATIO = 0.5
+
+
+def frame_path(path, suffix=FRAME_SUFFIX):
+    """The same stage output under another extension, e.g. london_trains.csv -> london_trains.feather."""
+    return os.path.splitext(path)[0] + suffix
+
+
+def compact_dtypes(df):
+    """Repeated text (station names, terminals, STP indicators, ...) becomes categorical."""
+    converted = {
+        col: df[col].astype("category") for col in df.columns
+        if df[col].dtype == object and len(df) and df[col].nunique() <= len(df) * CATEGORY_RATIO
+    }
+    return df.assign(**converted) if converted else df
+
+
+def write_frame(df, path, csv=False):
+    """Write a stage output as uncompressed Feather, so readers can memory-map it, and
+    optionally as CSV alongside it for people to open. Returns the Feather path."""
+    path = frame_path(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    feather.write_feather(compact_dtypes(df.reset_index(drop=True)), path, compression="uncompressed")
+    if csv:
+        df.to_csv(frame_path(path, ".csv"), index=False)
+    return path
+
+
+def resolve_frame(path):
+    """The file read_frame would read for a stage output: its Feather file, else an older CSV."""
+    for candidate in [frame_path(path), frame_path(path, ".csv")]:
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f"No Feather or CSV file for {frame_path(path)}")
+
+
+def read_frame(path, columns=None):
+    """Read a stage output (optionally just some columns), memory-mapping Feather files."""
+    path = resolve_frame(path)
+    if path.endswith(FRAME_SUFFIX):
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(path, usecols=columns)
+
+
+class FrameWriter:
+    """Write a stage output batch by batch into one compressed Feather file, for outputs too large
+    to build as a single frame. Batches share their columns; text stays plain rather than
+    categorical, as each batch would bring its own categories."""
+
+    def __init__(self, path, csv=False, compression="zstd"):
+        self.path = frame_path(path)
+        self.csv_path = frame_path(path, ".csv") if csv else None
+        self.compression = compression
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+
+    def write(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            self.schema = table.schema
+            self.writer = pa.ipc.new_file(self.path, self.schema, options=options)
+        self.writer.write_table(table.cast(self.schema))
+        if self.csv_path:
+            df.to_csv(self.csv_path, mode="a" if self.rows else "w", header=not self.rows, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
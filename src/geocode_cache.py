@@ -0,0 +1,85 @@
+
+#######################################################################
+### Persistent geocode cache shared by the station/terminal scripts ###
+#######################################################################
+
+import os
+import sqlite3
+import time
+import pandas as pd
+
+CACHE_PATH = "output/geocode_cache.db"
+LEGACY_CSV_PATH = "output/station_geocode_cache.csv"
+
+# Lookups that found nothing are tried again after this long
+NEGATIVE_TTL_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    query TEXT PRIMARY KEY,   -- the text sent to the geocoder
+    lat REAL,                 -- NULL when the geocoder found nothing
+    lon REAL,
+    looked_up_at INTEGER NOT NULL  -- unix seconds
+) WITHOUT ROWID;
+"""
+
+
+class GeocodeCache:
+    """Geocoder results keyed by query text, one committed row per lookup.
+
+    Each put is its own transaction, so an interrupted run keeps every lookup that finished.
+    Misses are stored too and count as cached until they are NEGATIVE_TTL_DAYS old.
+    """
+
+    def __init__(self, path=CACHE_PATH, negative_ttl_days=NEGATIVE_TTL_DAYS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.negative_ttl = negative_ttl_days * 86400
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fresh(self, queries):
+        """Cached entries for the queries that need no lookup: query, lat, lon (NaN for known misses)."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (query TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.conn.execute("DELETE FROM temp.wanted")
+        self.conn.executemany("INSERT OR IGNORE INTO temp.wanted VALUES (?)", [(q,) for q in queries])
+        return pd.read_sql_query(
+            """
+            SELECT g.query, g.lat, g.lon
+            FROM temp.wanted w
+            JOIN geocodes g ON g.query = w.query
+            WHERE g.lat IS NOT NULL OR g.looked_up_at >= ?
+            """,
+            self.conn, params=(int(time.time()) - self.negative_ttl,),
+        )
+
+    def put(self, query, lat, lon):
+        """Record one lookup (lat/lon None for a miss), committed straight away."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO geocodes (query, lat, lon, looked_up_at) VALUES (?, ?, ?, ?)",
+            (query, lat, lon, int(time.time())),
+        )
+
+    def import_legacy_csv(self, path, query_for):
+        """Carry over an old stop,lat,lon CSV cache once; its misses are retried on the next run."""
+        if not os.path.exists(path):
+            return 0
+        legacy = pd.read_csv(path).dropna(subset=["lat", "lon"])
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO geocodes (query, lat, lon, looked_up_at) VALUES (?, ?, ?, 0)",
+                [(query_for(stop), float(lat), float(lon)) for stop, lat, lon in
+                 zip(legacy["stop"], legacy["lat"], legacy["lon"])],
+            )
+        os.replace(path, path + ".imported")
+        return len(legacy)
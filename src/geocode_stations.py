@@ -1,42 +1,30 @@
 # geocode_stations.py
 
+import argparse
 import pandas as pd
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
 import os
+import metrics
+from frames import read_frame, write_frame
+from station_reference import REFERENCE_PATH, DB_PATH, load_station_reference, stop_tiplocs, offline_geocode
+from geocode_cache import CACHE_PATH, LEGACY_CSV_PATH, GeocodeCache
+
+parser = argparse.ArgumentParser(description="Add lat/lon to the expected travel times.")
+parser.add_argument("--reference", default=REFERENCE_PATH,
+                    help="Local station coordinate file (NaPTAN/CRS-style CSV), used before the network")
+parser.add_argument("--db", default=DB_PATH, help="Timetable database, for matching stops to the reference by TIPLOC")
+parser.add_argument("--offline", action="store_true", help="Never call the network geocoder")
+parser.add_argument("--cache", default=CACHE_PATH, help="Geocode cache shared with geocode_terminals.py")
+args = parser.parse_args()
+metrics.start_stage("geocode_stations")
 
 # Load original data
-df = pd.read_csv("output/expected_times_to_stops.csv")
+df = read_frame("output/expected_times_to_stops.feather")
 
 # Ensure output folder exists
 os.makedirs("output", exist_ok=True)
 
-# Load or create geocode cache
-cache_file = "output/station_geocode_cache.csv"
-try:
-    cache = pd.read_csv(cache_file)
-    print(f"Loaded geocode cache with {len(cache)} entries.")
-except FileNotFoundError:
-    cache = pd.DataFrame(columns=["stop", "lat", "lon"])
-    print("No cache found. Starting fresh.")
-
-# Identify new stops not yet in cache
-new_stops = df[['stop']].drop_duplicates().merge(
-    cache[['stop']], on='stop', how='left', indicator=True
-)
-new_stops = new_stops[new_stops['_merge'] == 'left_only'].drop(columns=['_merge'])
-
-# Set up geolocator with retry and timeout
-# Set up geolocator and rate limiter (pass timeout inside lambda)
-geolocator = Nominatim(user_agent="train_station_mapper")
-
-geocode = RateLimiter(
-    lambda query: geolocator.geocode(query, timeout=10),
-    min_delay_seconds=1,
-    max_retries=3,
-    error_wait_seconds=5
-)
-
 # Manual overrides: stop → (lat, lon)
 manual_geocodes = {
     "STRATFORD": (51.541216910923026, -0.0034744189350195444),
@@ -55,52 +43,85 @@ manual_geocodes = {
     "LEE": (51.449512838136314, 0.013787854881084178)
 }
 
-# Function to geocode a stop
-def get_lat_lon(row):
-    stop = row['stop'].upper()
-    country = row['country']
-
-    # Use manual override if available
-    if stop in manual_geocodes:
-        lat, lon = manual_geocodes[stop]
-        print(f"Using manual geocode for {stop}: {lat}, {lon}")
-        return pd.Series([stop, lat, lon])
-
-    # Otherwise use Nominatim
-    try:
-        location = geocode(f"{stop}, {country}, UK")
-        if location:
-            return pd.Series([stop, location.latitude, location.longitude])
-    except Exception as e:
-        print(f"Failed to geocode {stop}: {e}")
-    return pd.Series([stop, None, None])
-
-
-# Geocode only new stops
-if not new_stops.empty:
-    print(f"Geocoding {len(new_stops)} new stops...")
-    # Merge country info for new stops
-    df['country'] = 'England'
-    new_stops = new_stops.merge(df[['stop', 'country']].drop_duplicates(), on='stop', how='left')
-
-    # Apply geocoding function row-wise
-    geocoded_new = new_stops.apply(get_lat_lon, axis=1)
-    geocoded_new.columns = ['stop', 'lat', 'lon']
-
-    # Append to cache and save
-    cache = pd.concat([cache, geocoded_new], ignore_index=True)
-    cache.to_csv(cache_file, index=False)
+# --- Offline: manual overrides, then the local reference file in one join ---
+stops = df['stop'].astype(str).drop_duplicates()
+manual = pd.DataFrame(
+    [(stop, *manual_geocodes[stop.upper()]) for stop in stops if stop.upper() in manual_geocodes],
+    columns=["stop", "lat", "lon"]
+).astype({"lat": float, "lon": float})
+remaining = stops[~stops.isin(manual['stop'])]
+
+if os.path.exists(args.reference):
+    reference = load_station_reference(args.reference)
+    offline = offline_geocode(remaining, reference, stop_tiplocs(args.db)).dropna(subset=["lat", "lon"])
+    print(f"Matched {len(offline)} of {len(remaining)} stops from {args.reference}.")
 else:
-    print("No new stops to geocode.")
-
-# Merge cached coordinates with original data
-df = df.merge(cache, on="stop", how="left")
+    offline = manual.iloc[:0]
+    print(f"No station reference at {args.reference}. Using the network geocoder.")
+resolved = pd.concat([manual, offline], ignore_index=True)
+
+# --- Network: the shared geocode cache, then Nominatim for what it lacks ---
+def station_query(stop):
+    return f"{str(stop).upper()}, England, UK"
+
+new_stops = stops[~stops.isin(resolved['stop'])]
+queries = new_stops.map(station_query)
+
+with GeocodeCache(args.cache) as cache:
+    imported = cache.import_legacy_csv(LEGACY_CSV_PATH, station_query)
+    if imported:
+        print(f"Imported {imported} entries from {LEGACY_CSV_PATH}.")
+    cached = cache.fresh(queries)
+    print(f"Found {len(cached)} of {len(new_stops)} remaining stops in the geocode cache.")
+    to_geocode = new_stops[~queries.isin(cached['query'])]
+
+    if not to_geocode.empty and args.offline:
+        print(f"Offline: leaving {len(to_geocode)} stops ungeocoded.")
+    elif not to_geocode.empty:
+        print(f"Geocoding {len(to_geocode)} new stops...")
+
+        # Set up geolocator and rate limiter (pass timeout inside lambda)
+        geolocator = Nominatim(user_agent="train_station_mapper")
+        geocode = RateLimiter(
+            lambda query: geolocator.geocode(query, timeout=10),
+            min_delay_seconds=1,
+            max_retries=3,
+            error_wait_seconds=5,
+            swallow_exceptions=False
+        )
+
+        # Each result is committed as it arrives; errors are left uncached to retry next run
+        for stop in to_geocode:
+            query = station_query(stop)
+            try:
+                location = geocode(query)
+            except Exception as e:
+                print(f"Failed to geocode {stop}: {e}")
+                continue
+            if location:
+                cache.put(query, location.latitude, location.longitude)
+            else:
+                cache.put(query, None, None)
+        cached = cache.fresh(queries)
+    else:
+        print("No new stops to geocode.")
+
+# Merge coordinates with original data, offline matches first
+by_query = cached.dropna(subset=["lat", "lon"]).set_index("query")
+network = pd.DataFrame({"stop": new_stops.to_numpy(), "query": queries.to_numpy()})
+network = network.join(by_query, on="query", how="inner").drop(columns="query").astype({"lat": float, "lon": float})
+coords = pd.concat([resolved, network], ignore_index=True).drop_duplicates("stop")
+df = df.merge(coords, on="stop", how="left")
 
 # Drop rows where geocoding failed
 geocoded_df = df.dropna(subset=["lat", "lon"])
 print(f"Successfully geocoded {len(geocoded_df)} of {len(df)} rows.")
+metrics.count("rows_in", len(df))
+metrics.count("rows_out", len(geocoded_df))
+metrics.count("stops_offline", len(resolved))
+metrics.count("stops_network", len(network))
 
 # Save geocoded output
-geocoded_df.to_csv("output/expected_time_to_stops_geocoded.csv", index=False)
-print("Saved geocoded data to output/expected_time_to_stops_geocoded.csv")
+path = write_frame(geocoded_df, "output/expected_time_to_stops_geocoded.feather")
+print(f"Saved geocoded data to {path}")
 
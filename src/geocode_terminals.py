@@ -1,9 +1,23 @@
 # geocode_terminals.py
 
+import argparse
+import os
 import pandas as pd
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
-import os
+import metrics
+from frames import write_frame
+from expected_travel_times import terminal_tiplocs
+from station_reference import REFERENCE_PATH, load_station_reference, offline_geocode
+from geocode_cache import CACHE_PATH, GeocodeCache
+
+parser = argparse.ArgumentParser(description="Get lat/lon for the London terminals.")
+parser.add_argument("--reference", default=REFERENCE_PATH,
+                    help="Local station coordinate file (NaPTAN/CRS-style CSV), used before the network")
+parser.add_argument("--offline", action="store_true", help="Never call the network geocoder")
+parser.add_argument("--cache", default=CACHE_PATH, help="Geocode cache shared with geocode_stations.py")
+args = parser.parse_args()
+metrics.start_stage("geocode_terminals")
 
 # List of terminal names
 terminals = [
@@ -26,26 +40,52 @@ df = pd.DataFrame({'terminal': terminals})
 
 # Set up geocoder
 geolocator = Nominatim(user_agent="terminal_mapper")
-geocode = RateLimiter(lambda query: geolocator.geocode(query + ", London, UK"), 
-                      min_delay_seconds=1, max_retries=3, error_wait_seconds=5)
+geocode = RateLimiter(lambda query: geolocator.geocode(query), min_delay_seconds=1, max_retries=3,
+                      error_wait_seconds=5, swallow_exceptions=False)
 
-# Geocode function
-def get_lat_lon(terminal):
+def terminal_query(terminal):
+    return terminal + ", London, UK"
+
+# Geocode function, through the cache shared with geocode_stations.py
+def get_lat_lon(terminal, cache):
+    query = terminal_query(terminal)
+    cached = cache.fresh([query])
+    if len(cached):
+        return pd.Series([cached['lat'].iloc[0], cached['lon'].iloc[0]])
+    if args.offline:
+        return pd.Series([None, None])
     try:
-        location = geocode(terminal)
-        if location:
-            return pd.Series([location.latitude, location.longitude])
+        location = geocode(query)
     except Exception as e:
         print(f"Failed to geocode {terminal}: {e}")
+        return pd.Series([None, None])
+    if location:
+        cache.put(query, location.latitude, location.longitude)
+        return pd.Series([location.latitude, location.longitude])
+    cache.put(query, None, None)
     return pd.Series([None, None])
 
-# Apply geocoding
-df[['lat', 'lon']] = df['terminal'].apply(get_lat_lon)
+# Look terminals up in the local reference by their TIPLOCs, then by name
+df['lat'] = float('nan')
+df['lon'] = float('nan')
+if os.path.exists(args.reference):
+    tiplocs = pd.DataFrame(
+        [(terminal, code) for terminal, codes in terminal_tiplocs.items() for code in codes],
+        columns=['stop', 'tiploc_code']
+    )
+    offline = offline_geocode(df['terminal'], load_station_reference(args.reference), tiplocs)
+    df[['lat', 'lon']] = offline[['lat', 'lon']].to_numpy()
+
+# Apply geocoding to the rest
+missing = df['lat'].isna()
+if missing.any():
+    with GeocodeCache(args.cache) as cache:
+        df.loc[missing, ['lat', 'lon']] = df.loc[missing, 'terminal'].apply(get_lat_lon, cache=cache).to_numpy(dtype=float)
 
 # Drop failures
 df = df.dropna(subset=['lat', 'lon'])
+metrics.count("rows_out", len(df))
 
 # Save output
-os.makedirs("output", exist_ok=True)
-df.to_csv("output/london_terminals_geocoded.csv", index=False)
-print("Saved geocoded terminals to output/london_terminals_geocoded.csv")
+path = write_frame(df, "output/london_terminals_geocoded.feather")
+print(f"Saved geocoded terminals to {path}")
@@ -3,10 +3,18 @@
 ### Query the SQLite database for services that start at or stop at a London terminal ###
 #########################################################################################
 
+import argparse
 import sqlite3
+import numpy as np
 import pandas as pd
-import re
-from datetime import datetime
+import metrics
+from frames import write_frame
+
+parser = argparse.ArgumentParser(description="Extract every call of trains serving a London terminal.")
+parser.add_argument("--output", default="output/london_trains.feather")
+parser.add_argument("--csv", action="store_true", help="Also write a CSV copy for inspection")
+args = parser.parse_args()
+metrics.start_stage("london_services")
 
 # --- Map each terminal to all its TIPLOCs ---
 terminal_tiplocs = {
@@ -28,84 +36,106 @@ terminal_tiplocs = {
 # Flatten all TIPLOCs into a set
 all_tiplocs = [code for codes in terminal_tiplocs.values() for code in codes]
 
+# Rows fetched from SQLite per chunk; each chunk is compacted before the next is read
+CHUNK_ROWS = 200_000
+
 # --- Connect to DB ---
 conn = sqlite3.connect("db/timetable.db")
 
+# Fixed category sets, so every chunk's categoricals share one dtype and concatenate cheaply
+tiploc_codes = pd.CategoricalDtype(sorted(r[0] for r in conn.execute("SELECT tiploc_code FROM tiplocs")))
+stop_names = pd.CategoricalDtype(sorted(
+    r[0] for r in conn.execute("SELECT DISTINCT station_name FROM tiplocs WHERE station_name IS NOT NULL")
+))
+
 placeholders = ",".join(["?"] * len(all_tiplocs))
 
+# Trains calling at a terminal are found through the TIPLOC index, then each one's
+# locations are a range read on the (train_id, seq) primary key. Only the columns the
+# later stages use are selected; origin and destination names just filter out trains
+# whose ends are unknown.
 query = f"""
+WITH london_trains AS (
+    SELECT DISTINCT tl2.train_id
+    FROM tiplocs terminal
+    JOIN train_locations tl2 ON tl2.tiploc_id = terminal.tiploc_id
+    WHERE terminal.tiploc_code IN ({placeholders})
+)
 SELECT
-    tl.*,
-    t.stp_indicator,
-    t.runs_on,
-    t.origin,
-    t.destination,
-    origin_station.station_name AS origin_name,
-    dest_station.station_name AS destination_name,
-    stop_station.station_name AS stop_name
-FROM train_locations tl
+    tl.train_id,
+    tl.seq,
+    stop_station.tiploc_code,
+    stop_station.station_name AS stop_name,
+    tl.arrival AS arr_time,
+    tl.departure AS dep_time,
+    tl.activity = 'LO' AS is_origin,
+    t.runs_on
+FROM london_trains lt
+JOIN train_locations tl ON tl.train_id = lt.train_id
 JOIN trains t ON t.train_id = tl.train_id
-JOIN tiplocs origin_station ON origin_station.tiploc_code = t.origin
-JOIN tiplocs dest_station ON dest_station.tiploc_code = t.destination
-LEFT JOIN tiplocs stop_station ON stop_station.tiploc_code = tl.tiploc_code
-WHERE EXISTS (
-    SELECT 1
-    FROM train_locations tl2
-    WHERE tl2.train_id = tl.train_id AND tl2.tiploc_code IN ({placeholders})
-)
+JOIN tiplocs origin_station ON origin_station.tiploc_id = t.origin_id
+JOIN tiplocs dest_station ON dest_station.tiploc_id = t.destination_id
+JOIN tiplocs stop_station ON stop_station.tiploc_id = tl.tiploc_id
+WHERE origin_station.station_name IS NOT NULL
+  AND dest_station.station_name IS NOT NULL
+ORDER BY tl.train_id, tl.seq
 """
 
-df = pd.read_sql_query(query, conn, params=all_tiplocs)
+day_names = ["runs_mon", "runs_tue", "runs_wed", "runs_thu", "runs_fri", "runs_sat", "runs_sun"]
+
+
+def compact(chunk):
+    """Small dtypes throughout: minutes fit float32 exactly (NaN where there is no public time)."""
+    out = pd.DataFrame({
+        "train_id": chunk["train_id"].astype(np.int32),
+        "seq": chunk["seq"].astype(np.int16),
+        "tiploc_code": chunk["tiploc_code"].astype(tiploc_codes),
+        "stop_name": chunk["stop_name"].astype(stop_names),
+        "arr_time": chunk["arr_time"].astype(np.float32),
+        "dep_time": chunk["dep_time"].astype(np.float32),
+        "is_origin": chunk["is_origin"].fillna(0).astype(bool),
+    })
+    # --- Expand runs_on flags ---
+    runs_on = chunk["runs_on"].fillna("0000000")
+    for i, name in enumerate(day_names):
+        out[name] = (runs_on.str[i] == "1").astype(np.int8)
+    return out
+
+
+with metrics.section("sql_query"):
+    chunks = pd.read_sql_query(query, conn, params=all_tiplocs, chunksize=CHUNK_ROWS)
+    df = pd.concat([compact(chunk) for chunk in chunks], ignore_index=True)
 conn.close()
+metrics.count("rows_in", len(df))
+
+# --- Origin time ---
+# Times are stored as minutes after midnight, so everything below is column arithmetic
+origin_times = (
+    df.loc[df["is_origin"], ["train_id", "dep_time"]]
+    .drop_duplicates("train_id")
+    .set_index("train_id")["dep_time"]
+)
+df["origin_time"] = df["train_id"].map(origin_times).astype(np.float32)
 
-# --- Expand runs_on flags ---
-day_names = ["runs_mon", "runs_tue", "runs_wed", "runs_thu", "runs_fri", "runs_sat", "runs_sun"]
-for i, name in enumerate(day_names):
-    df[name] = df["runs_on"].str[i].fillna("0").astype(int)
-
-# --- Time parsing ---
-def clean_time(t):
-    if pd.isna(t):
-        return None
-    t = re.sub(r"[^\d]", "", t)
-    if len(t) != 4:
-        return None
-    return datetime.strptime(t, "%H%M")
-
-df["arr_time"] = df["arrival"].apply(clean_time)
-df["dep_time"] = df["departure"].apply(clean_time)
-
-# --- Determine origin time ---
-origin_times = df[df["activity"] == "LO"][["train_id", "dep_time"]].rename(columns={"dep_time": "origin_time"})
-df = df.merge(origin_times, on="train_id", how="left")
-
-# Fallback to first dep_time if still missing
+# Fallback to the first dep_time if still missing
 if df["origin_time"].isna().any():
-    fallback = (
-        df[df["seq"] == df.groupby("train_id")["seq"].transform("min")][["train_id", "dep_time"]]
-        .rename(columns={"dep_time": "origin_time"})
-    )
-    df = df.drop(columns="origin_time").merge(fallback, on="train_id", how="left")
+    first_rows = df.loc[df.groupby("train_id")["seq"].idxmin(), ["train_id", "dep_time"]]
+    first_dep = first_rows.set_index("train_id")["dep_time"]
+    df["origin_time"] = df["origin_time"].fillna(df["train_id"].map(first_dep))
+df = df.drop(columns="is_origin")
 
 # --- Elapsed time ---
-def compute_elapsed(row):
-    current_time = row["arr_time"] if pd.notna(row["arr_time"]) else row["dep_time"]
-    origin_time = row["origin_time"]
-    if pd.isna(current_time) or pd.isna(origin_time):
-        return None
-    elapsed = (current_time - origin_time).total_seconds() / 60
-    if elapsed < 0:
-        elapsed += 1440  # Wrap past midnight
-    return elapsed
-
-df["elapsed_from_origin"] = df.apply(compute_elapsed, axis=1)
+current_time = df["arr_time"].fillna(df["dep_time"])
+elapsed = current_time - df["origin_time"]
+df["elapsed_from_origin"] = np.where(elapsed < 0, elapsed + 1440, elapsed).astype(np.float32)  # Wrap past midnight
 
 # --- Output ---
 print(df[[
-    "train_id", "tiploc_code", "activity", "arrival", "departure",
-    "origin_name", "destination_name", "stop_name", "elapsed_from_origin"
+    "train_id", "tiploc_code", "arr_time", "dep_time", "stop_name", "elapsed_from_origin"
 ] + day_names].head(10))
+print(f"{len(df)} rows, {df.memory_usage(deep=True).sum() / 1e6:.1f} MB in memory")
 
-df.to_csv("output/london_trains.csv", index=False)
-print("Saved to output/london_trains.csv")
-
+metrics.count("rows_out", len(df))
+with metrics.section("write"):
+    path = write_frame(df, args.output, csv=args.csv)
+print(f"Saved to {path}")
@@ -0,0 +1,172 @@
+
+######################################################################################
+### Travel-time isochrone grids from each terminal, precomputed for create_map.py ###
+######################################################################################
+
+import argparse
+import hashlib
+import math
+import os
+import numpy as np
+from frames import read_frame, resolve_frame
+
+GEOCODED_PATH = "output/expected_time_to_stops_geocoded.feather"
+CACHE_DIR = "output/cache"
+
+# Bump when the layout of the cached grids changes
+ISOCHRONE_CACHE_VERSION = 1
+
+DEFAULT_BANDS = [30, 45, 60, 90]
+DEFAULT_CELL_KM = 1.0
+
+# Getting from a station to a grid cell: walking pace, and how far anyone walks
+ACCESS_MIN_PER_KM = 12.0
+MAX_ACCESS_KM = 3.0
+
+KM_PER_DEG_LAT = 110.57
+KM_PER_DEG_LON_EQUATOR = 111.32
+
+ALL_TERMINALS = "ALL TERMINALS"
+
+
+# --- Grid ---
+def mercator_y(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def mercator_lat(y):
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+def make_grid(lats, lons, cell_km=DEFAULT_CELL_KM, pad_km=MAX_ACCESS_KM):
+    """Cell centres covering the stops, as (row_lats, col_lons, bounds).
+
+    Columns are evenly spaced in longitude and rows evenly spaced in Web Mercator y, so the
+    grid drops straight onto a Leaflet image overlay. Rows run north to south.
+    """
+    lat0 = float(np.mean(lats))
+    km_per_deg_lon = KM_PER_DEG_LON_EQUATOR * math.cos(math.radians(lat0))
+    south = float(np.min(lats)) - pad_km / KM_PER_DEG_LAT
+    north = float(np.max(lats)) + pad_km / KM_PER_DEG_LAT
+    west = float(np.min(lons)) - pad_km / km_per_deg_lon
+    east = float(np.max(lons)) + pad_km / km_per_deg_lon
+
+    nx = max(1, math.ceil((east - west) * km_per_deg_lon / cell_km))
+    dx = (east - west) / nx
+    # Mercator y is in radians of longitude, so the same step keeps cells square on screen
+    y_north, y_south = mercator_y(north), mercator_y(south)
+    ny = max(1, math.ceil((y_north - y_south) / math.radians(dx)))
+    y_edges = np.linspace(y_north, y_south, ny + 1)
+
+    col_lons = west + dx * (np.arange(nx) + 0.5)
+    row_lats = mercator_lat((y_edges[:-1] + y_edges[1:]) / 2)
+    bounds = [[float(mercator_lat(y_edges[-1])), west], [float(mercator_lat(y_edges[0])), east]]
+    return row_lats, col_lons, bounds
+
+
+def travel_time_grid(row_lats, col_lons, stop_lats, stop_lons, stop_minutes,
+                     access_min_per_km=ACCESS_MIN_PER_KM, max_access_km=MAX_ACCESS_KM):
+    """Minutes to each cell: the best over stations of the station's time plus the walk from it.
+
+    Each station only updates the window of cells within walking range, one vectorised
+    minimum per station. Cells out of range of every station are inf.
+    """
+    times = np.full((len(row_lats), len(col_lons)), np.inf, dtype=np.float32)
+    ascending_lats = row_lats[::-1]
+    for lat, lon, minutes in zip(stop_lats, stop_lons, stop_minutes):
+        km_per_deg_lon = KM_PER_DEG_LON_EQUATOR * math.cos(math.radians(lat))
+        reach_lat = max_access_km / KM_PER_DEG_LAT
+        reach_lon = max_access_km / km_per_deg_lon
+
+        # Rows are stored north to south; find the window on the ascending copy
+        lo = np.searchsorted(ascending_lats, lat - reach_lat, side="left")
+        hi = np.searchsorted(ascending_lats, lat + reach_lat, side="right")
+        r0, r1 = len(row_lats) - hi, len(row_lats) - lo
+        c0 = np.searchsorted(col_lons, lon - reach_lon, side="left")
+        c1 = np.searchsorted(col_lons, lon + reach_lon, side="right")
+        if r0 >= r1 or c0 >= c1:
+            continue
+
+        dy = (row_lats[r0:r1, None] - lat) * KM_PER_DEG_LAT
+        dx = (col_lons[None, c0:c1] - lon) * km_per_deg_lon
+        distance = np.sqrt(dy * dy + dx * dx)
+        cell_times = np.where(distance <= max_access_km, minutes + distance * access_min_per_km, np.inf)
+        np.minimum(times[r0:r1, c0:c1], cell_times, out=times[r0:r1, c0:c1])
+    return times
+
+
+def band_grid(times, bands):
+    """Band index per cell: 0 within the first threshold ... len(bands) beyond the last."""
+    return np.searchsorted(np.asarray(bands, dtype=np.float32), times, side="left").astype(np.uint8)
+
+
+# --- Isochrones ---
+def compute_isochrones(df, bands=DEFAULT_BANDS, cell_km=DEFAULT_CELL_KM,
+                       access_min_per_km=ACCESS_MIN_PER_KM, max_access_km=MAX_ACCESS_KM):
+    """Banded grids for each terminal and for the quickest of all terminals.
+
+    df has terminal, lat, lon and expected_minutes per (terminal, stop), as written by
+    geocode_stations.py. Returns a dict of arrays ready for np.savez.
+    """
+    df = df.dropna(subset=["lat", "lon", "expected_minutes"])
+    row_lats, col_lons, bounds = make_grid(df["lat"].to_numpy(), df["lon"].to_numpy(), cell_km, max_access_km)
+
+    terminals = sorted(df["terminal"].astype(str).unique())
+    grids = []
+    for terminal in terminals:
+        stops = df[df["terminal"].astype(str) == terminal]
+        grids.append(travel_time_grid(
+            row_lats, col_lons, stops["lat"].to_numpy(), stops["lon"].to_numpy(),
+            stops["expected_minutes"].to_numpy(), access_min_per_km, max_access_km,
+        ))
+    quickest = np.min(grids, axis=0) if grids else np.full((len(row_lats), len(col_lons)), np.inf, np.float32)
+
+    return {
+        "terminals": np.array(terminals + [ALL_TERMINALS]),
+        "bands": np.array(bands, dtype=np.float32),
+        "grids": np.stack([band_grid(g, bands) for g in grids + [quickest]]),
+        "bounds": np.array(bounds),
+    }
+
+
+def _cache_path(path, cache_dir, params):
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{params}|{ISOCHRONE_CACHE_VERSION}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"isochrones_{digest}.npz")
+
+
+def load_isochrones(path=GEOCODED_PATH, cache_dir=CACHE_DIR, bands=DEFAULT_BANDS, cell_km=DEFAULT_CELL_KM,
+                    access_min_per_km=ACCESS_MIN_PER_KM, max_access_km=MAX_ACCESS_KM):
+    """Isochrone grids for the geocoded travel times, reusing the cache while inputs are unchanged."""
+    source = resolve_frame(path)
+    params = tuple(float(x) for x in [*bands, cell_km, access_min_per_km, max_access_km])
+    cache_path = _cache_path(source, cache_dir, params) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return {name: cached[name] for name in cached.files}
+
+    isochrones = compute_isochrones(read_frame(source), bands, cell_km, access_min_per_km, max_access_km)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez_compressed(cache_path, **isochrones)
+    return isochrones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute travel-time isochrone grids for the map.")
+    parser.add_argument("--input", default=GEOCODED_PATH, help="Output of geocode_stations.py")
+    parser.add_argument("--bands", default=",".join(map(str, DEFAULT_BANDS)), help="Band edges in minutes")
+    parser.add_argument("--cell-km", type=float, default=DEFAULT_CELL_KM, help="Grid cell size")
+    parser.add_argument("--walk-min-per-km", type=float, default=ACCESS_MIN_PER_KM,
+                        help="Minutes per km from a station to a cell")
+    parser.add_argument("--max-walk-km", type=float, default=MAX_ACCESS_KM,
+                        help="Cells further than this from every station are left out")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute even if a cached grid exists")
+    args = parser.parse_args()
+
+    bands = [float(b) for b in args.bands.split(",")]
+    isochrones = load_isochrones(args.input, None if args.no_cache else CACHE_DIR, bands, args.cell_km,
+                                 args.walk_min_per_km, args.max_walk_km)
+    n_layers, ny, nx = isochrones["grids"].shape
+    print(f"{n_layers} isochrone layers on a {ny} x {nx} grid")
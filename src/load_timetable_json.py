@@ -0,0 +1,662 @@
+
+###################################################################################
+### Single-pass loader for TIPLOCs and schedules from the toc-full JSON extract ###
+###################################################################################
+
+import argparse
+import io
+import itertools
+import json
+import os
+import re
+import sqlite3
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+from calendar_index import encode_calendar
+from create_schema import SCHEMA_VERSION, create_indexes, create_schema, drop_indexes, schema_version
+from time_encoding import encode_time
+
+TOC_FULL_PATH = "data/timetable/toc-full"
+TIMETABLE_ZIP_PATH = "data/timetable.zip"
+DB_PATH = "db/timetable.db"
+
+# Rows buffered before an executemany flush, and rows per transaction
+BATCH_SIZE = 50_000
+COMMIT_EVERY = 500_000
+
+# Size of the newline-aligned byte ranges handed to parser processes
+CHUNK_SIZE = 32 * 1024 * 1024
+
+# Trade durability for speed: a failed bulk load is simply re-run from scratch
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",  # 256 MB
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+# Filtered loads may skip created permanent/new schedules without decoding them when no
+# kept TIPLOC appears in the line
+SKIPPABLE_STP = re.compile(r'"CIF_stp_indicator":\s*"[PN]"')
+CREATE_TRANSACTION = re.compile(r'"transaction_type":\s*"Create"')
+
+# Hot sections reported by metrics.py
+JSON_DECODE = metrics.section("json_decode")
+TIME_PARSING = metrics.section("time_parsing")
+SQL_INSERT = metrics.section("sql_insert")
+
+
+# --- Record parsing ---
+def parse_tiploc(tiploc):
+    code = tiploc["tiploc_code"]
+    name = tiploc.get("tps_description") or tiploc.get("description") or "Unknown"
+    return code, name.strip()
+
+
+def schedule_key(sched):
+    train_uid = sched.get("CIF_train_uid")
+    stp_indicator = sched.get("CIF_stp_indicator")
+    start_date = sched.get("schedule_start_date")
+
+    if not train_uid or not stp_indicator or not start_date:
+        return None
+
+    # Use composite key
+    return f"{train_uid}_{stp_indicator}_{start_date}"
+
+
+def parse_schedule(sched, keep_tiplocs=None):
+    """Return (train_row, location_rows) for a Create schedule, or None to skip it.
+
+    With keep_tiplocs, schedules with no public call at any of those TIPLOCs are skipped,
+    except that overlays are kept as location-less stubs: an overlay that avoids the set
+    still stops the permanent schedule it replaces from running on its dates.
+    """
+    # Only process newly created schedules
+    if sched.get("transaction_type") != "Create":
+        return None
+
+    train_id = schedule_key(sched)
+    locations = (sched.get("schedule_segment") or {}).get("schedule_location") or []
+    stp_indicator = sched.get("CIF_stp_indicator")
+
+    if not train_id:
+        return None
+
+    # STP cancellations carry no locations but still knock out the schedule on their dates
+    if stp_indicator == "C":
+        origin = destination = None
+    else:
+        if not locations:
+            return None
+        origin = locations[0].get("tiploc_code")
+        destination = locations[-1].get("tiploc_code")
+        if not origin or not destination:
+            return None
+
+    # Filtered loads drop schedules with no public call at a kept TIPLOC before encoding
+    # anything; overlays stay as stubs without locations
+    if keep_tiplocs is not None and stp_indicator != "C" and not any(
+        (loc.get("tiploc_code") or "").strip() in keep_tiplocs
+        and (loc.get("public_arrival") or loc.get("public_departure"))
+        for loc in locations
+    ):
+        if stp_indicator != "O":
+            return None
+        origin = destination = None
+        locations = []
+
+    train_uid = sched["CIF_train_uid"]
+    start_date = sched["schedule_start_date"]
+    end_date = sched.get("schedule_end_date")
+    runs_on = sched.get("schedule_days_runs")
+    calendar_start, calendar = encode_calendar(start_date, end_date, runs_on)
+
+    train_row = (
+        train_id,
+        train_uid,
+        stp_indicator,
+        sched.get("train_service_code"),
+        runs_on,
+        start_date,
+        end_date,
+        origin,
+        destination,
+        calendar_start,
+        calendar,
+    )
+
+    location_rows = []
+    with TIME_PARSING:
+        for i, loc in enumerate(locations):
+            tiploc = loc.get("tiploc_code")
+            public_arrival = loc.get("public_arrival")
+            public_departure = loc.get("public_departure")
+
+            if not tiploc or (not public_arrival and not public_departure):
+                continue
+
+            location_rows.append((
+                i,
+                tiploc.strip(),
+                encode_time(public_arrival),
+                encode_time(public_departure),
+                loc.get("platform"),
+                loc.get("location_type"),
+            ))
+
+    return train_row, location_rows
+
+
+def iter_records(lines, keep_tiplocs=None):
+    """Yield (kind, payload) pairs from JSON lines.
+
+    Kinds are "tiploc" (a created or amended TIPLOC row), "tiploc_delete" (a TIPLOC code),
+    "schedule" (train_row, location_rows) and "schedule_delete" (a train_id). keep_tiplocs
+    filters schedules as in parse_schedule.
+    """
+    kept_code = None
+    if keep_tiplocs is not None:
+        kept_code = re.compile("|".join(f'"{re.escape(code)}"' for code in sorted(keep_tiplocs)))
+
+    for line in lines:
+        # Cheap substring checks avoid decoding association and header records
+        if '"TiplocV1"' in line:
+            kind = "TiplocV1"
+        elif '"JsonScheduleV1"' in line:
+            kind = "JsonScheduleV1"
+            # ...and, when filtering, permanent or new schedules that never mention a kept TIPLOC
+            if (kept_code is not None and not kept_code.search(line)
+                    and SKIPPABLE_STP.search(line) and CREATE_TRANSACTION.search(line)):
+                continue
+        else:
+            continue
+
+        try:
+            with JSON_DECODE:
+                record = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # Skip badly formatted lines
+
+        if kind == "TiplocV1" and "TiplocV1" in record:
+            tiploc = record["TiplocV1"]
+            if tiploc.get("transaction_type") == "Delete":
+                yield "tiploc_delete", tiploc["tiploc_code"]
+            else:
+                yield "tiploc", parse_tiploc(tiploc)
+        elif kind == "JsonScheduleV1" and "JsonScheduleV1" in record:
+            sched = record["JsonScheduleV1"]
+            if sched.get("transaction_type") == "Delete":
+                train_id = schedule_key(sched)
+                if train_id is not None:
+                    yield "schedule_delete", train_id
+            else:
+                parsed = parse_schedule(sched, keep_tiplocs)
+                if parsed is not None:
+                    yield "schedule", parsed
+
+
+# --- Input ---
+def default_input():
+    # Read straight from the downloaded archive unless it has already been extracted
+    if not os.path.exists(TOC_FULL_PATH) and os.path.exists(TIMETABLE_ZIP_PATH):
+        return TIMETABLE_ZIP_PATH
+    return TOC_FULL_PATH
+
+
+def find_toc_member(zf):
+    for name in zf.namelist():
+        if os.path.basename(name).startswith("toc-full"):
+            return name
+    raise ValueError(f"No toc-full member in {zf.filename}: {zf.namelist()}")
+
+
+@contextmanager
+def open_timetable(path, member=None):
+    """Open toc-full for line-by-line reading, decompressing on the fly from a ZIP if given one."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf, zf.open(member or find_toc_member(zf)) as raw:
+            yield io.TextIOWrapper(raw, encoding="utf-8")
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield f
+
+
+def read_extract_header(path, member=None, max_lines=10):
+    """Return the type, sequence and timestamp from the extract's JsonTimetableV1 header, if any."""
+    with open_timetable(path, member) as f:
+        for line in itertools.islice(f, max_lines):
+            if '"JsonTimetableV1"' in line:
+                header = json.loads(line)["JsonTimetableV1"]
+                metadata = header.get("Metadata", {})
+                return {
+                    "type": metadata.get("type"),
+                    "sequence": metadata.get("sequence"),
+                    "timestamp": header.get("timestamp"),
+                }
+    return None
+
+
+# --- Applied extract bookkeeping ---
+def last_applied_extract(conn):
+    return conn.execute("""
+        SELECT extract_type, sequence, timestamp, source, applied_at
+        FROM applied_extracts
+        ORDER BY id DESC
+        LIMIT 1
+    """).fetchone()
+
+
+def check_update_sequence(conn, header, force=False):
+    """Return True if a daily update should be applied on top of what the database holds."""
+    last = last_applied_extract(conn)
+    if last is None:
+        raise Exception("No extract has been applied to this database yet; load a full extract first")
+
+    sequence = header.get("sequence") if header else None
+    if sequence is None or last[1] is None:
+        if not force:
+            raise Exception("Cannot check the update sequence (missing header); use --force to apply anyway")
+        return True
+
+    if sequence <= last[1]:
+        print(f"Extract {sequence} is not newer than the last applied extract ({last[1]}); skipping.")
+        return False
+    if sequence != last[1] + 1 and not force:
+        raise Exception(f"Expected update {last[1] + 1} but got {sequence}; use --force to apply anyway")
+    return True
+
+
+def record_applied_extract(conn, header, source, incremental):
+    header = header or {}
+    conn.execute("""
+        INSERT INTO applied_extracts (extract_type, sequence, timestamp, source, applied_at)
+        VALUES (?, ?, ?, ?, datetime('now'))
+    """, (
+        header.get("type") or ("update" if incremental else "full"),
+        header.get("sequence"),
+        header.get("timestamp"),
+        os.path.basename(source),
+    ))
+
+
+# --- Ingest filter ---
+def read_tiploc_filter(spec):
+    """TIPLOC codes from a comma-separated list, or from a file with one code per line."""
+    if os.path.isfile(spec):
+        with open(spec, "r") as f:
+            codes = [line.strip() for line in f]
+    else:
+        codes = [code.strip() for code in spec.split(",")]
+    return frozenset(code for code in codes if code)
+
+
+def stored_ingest_filter(conn):
+    codes = frozenset(row[0] for row in conn.execute("SELECT tiploc_code FROM ingest_filter"))
+    return codes or None
+
+
+def store_ingest_filter(conn, keep_tiplocs):
+    conn.execute("DELETE FROM ingest_filter")
+    conn.executemany("INSERT INTO ingest_filter (tiploc_code) VALUES (?)",
+                     ((code,) for code in sorted(keep_tiplocs or [])))
+
+
+def prune_tiplocs(conn):
+    """Drop TIPLOCs no stored schedule refers to; returns how many went."""
+    return conn.execute("""
+        DELETE FROM tiplocs
+        WHERE tiploc_id NOT IN (
+            SELECT tiploc_id FROM train_locations
+            UNION SELECT origin_id FROM trains WHERE origin_id IS NOT NULL
+            UNION SELECT destination_id FROM trains WHERE destination_id IS NOT NULL
+        )
+    """).rowcount
+
+
+# --- Parallel parsing ---
+def chunk_offsets(path, chunk_size=CHUNK_SIZE):
+    """Split a file into (start, end) byte ranges that begin and end on line boundaries."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        while bounds[-1] + chunk_size < size:
+            f.seek(bounds[-1] + chunk_size)
+            f.readline()  # Run on to the end of the line we landed in
+            bounds.append(f.tell())
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_chunk(path, start, end, keep_tiplocs=None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return parse_lines(data.decode("utf-8").splitlines(), keep_tiplocs)
+
+
+def parse_lines(lines, keep_tiplocs=None):
+    """Records and this worker's section timings for a batch of lines."""
+    metrics.take_sections()  # Drop anything inherited from the parent process
+    records = list(iter_records(lines, keep_tiplocs))
+    return records, metrics.take_sections()
+
+
+def _results_in_order(futures, workers):
+    # Bound the chunks in flight so a slow writer cannot buffer the whole file
+    pending = deque()
+    for future in futures:
+        pending.append(future)
+        if len(pending) >= workers * 2:
+            records, sections = pending.popleft().result()
+            metrics.merge_sections(sections)
+            yield from records
+    while pending:
+        records, sections = pending.popleft().result()
+        metrics.merge_sections(sections)
+        yield from records
+
+
+def iter_records_parallel(path, workers, chunk_size=CHUNK_SIZE, member=None, keep_tiplocs=None):
+    """Yield the same records as iter_records, decoded in a process pool but in file order."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if zipfile.is_zipfile(path):
+            # A compressed member cannot be split by byte offset, so ship batches of lines
+            with open_timetable(path, member) as f:
+                batches = iter(lambda: f.readlines(chunk_size), [])
+                futures = (pool.submit(parse_lines, b, keep_tiplocs) for b in batches)
+                yield from _results_in_order(futures, workers)
+        else:
+            chunks = chunk_offsets(path, chunk_size)
+            futures = (pool.submit(parse_chunk, path, s, e, keep_tiplocs) for s, e in chunks)
+            yield from _results_in_order(futures, workers)
+
+
+# --- Batched writer ---
+class TimetableWriter:
+    """Buffer parsed rows, encode TIPLOC codes and schedule keys as integer ids, and write
+    them with executemany.
+
+    A full load keeps the first row seen for each key, as the original loaders did. An
+    incremental load applies the update feed in place: Creates replace any existing schedule
+    with the same key, TIPLOC amendments overwrite the name, and Deletes remove the schedule
+    (with its locations) or clear the TIPLOC's name.
+    """
+
+    def __init__(self, conn, batch_size=BATCH_SIZE, commit_every=COMMIT_EVERY, incremental=False):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.incremental = incremental
+
+        # Surrogate ids already allocated in the database
+        self.tiploc_ids = dict(conn.execute("SELECT tiploc_code, tiploc_id FROM tiplocs"))
+        self.train_ids = dict(conn.execute(
+            "SELECT train_uid || '_' || stp_indicator || '_' || start_date, train_id FROM trains"
+        ))
+        self.next_tiploc_id = max(self.tiploc_ids.values(), default=0) + 1
+        self.next_train_id = max(self.train_ids.values(), default=0) + 1
+
+        self.new_tiplocs = []
+        self.tiploc_names = []
+        self.trains = []
+        self.locations = []
+        self.tiploc_deletes = []
+        self.train_deletes = []
+        self.pending_keys = set()
+        self.named_tiplocs = set()
+        self.tiploc_count = 0
+        self.train_count = 0
+        self.location_count = 0
+        self.delete_count = 0
+        self.rows_written = 0
+        self.uncommitted = 0
+
+    def tiploc_id(self, code):
+        if code is None:
+            return None
+        tiploc_id = self.tiploc_ids.get(code)
+        if tiploc_id is None:
+            # Schedules may reference a TIPLOC before (or without) its TiplocV1 record
+            tiploc_id = self.tiploc_ids[code] = self.next_tiploc_id
+            self.next_tiploc_id += 1
+            self.new_tiplocs.append((tiploc_id, code))
+        return tiploc_id
+
+    def add_tiploc(self, row):
+        code, name = row
+        if code in self.named_tiplocs and not self.incremental:
+            return
+        self.named_tiplocs.add(code)
+        self.tiploc_names.append((name, self.tiploc_id(code)))
+        self.pending_keys.add(("tiploc", code))
+        self.tiploc_count += 1
+        self._maybe_flush()
+
+    def add_schedule(self, train_row, location_rows):
+        key = train_row[0]
+        if self.incremental:
+            self.delete_schedule(key, count=False)
+
+        train_id = self.train_ids.get(key)
+        if train_id is None:
+            train_id = self.train_ids[key] = self.next_train_id
+            self.next_train_id += 1
+            origin, destination = train_row[7], train_row[8]
+            self.trains.append(
+                (train_id,) + train_row[1:7]
+                + (self.tiploc_id(origin), self.tiploc_id(destination))
+                + train_row[9:11]
+            )
+            self.pending_keys.add(("train", train_id))
+
+        # A repeated key keeps its first train row, but locations at new seqs still go in
+        tiploc_id = self.tiploc_id
+        self.locations.extend(
+            (train_id, seq, tiploc_id(code), arrival, departure, platform, activity)
+            for seq, code, arrival, departure, platform, activity in location_rows
+        )
+
+        self.train_count += 1
+        self.location_count += len(location_rows)
+        self._maybe_flush()
+
+    def delete_tiploc(self, code):
+        if code in self.tiploc_ids:
+            self._queue_delete(self.tiploc_deletes, ("tiploc", code), code, count=True)
+
+    def delete_schedule(self, key, count=True):
+        train_id = self.train_ids.pop(key, None)
+        if train_id is not None:
+            self._queue_delete(self.train_deletes, ("train", train_id), train_id, count)
+
+    def _queue_delete(self, deletes, pending_key, value, count):
+        # Deletes run before inserts in a flush, so a delete of a row that is still
+        # waiting to be inserted has to push that insert out first
+        if pending_key in self.pending_keys:
+            self.flush()
+        deletes.append((value,))
+        if count:
+            self.delete_count += 1
+
+    def _maybe_flush(self):
+        if len(self.tiploc_names) + len(self.trains) + len(self.locations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with SQL_INSERT:
+            self._flush()
+
+    def _flush(self):
+        c = self.conn.cursor()
+        # TIPLOC rows are kept so their ids stay valid; a deleted TIPLOC loses its name
+        c.executemany("UPDATE tiplocs SET station_name = NULL WHERE tiploc_code = ?", self.tiploc_deletes)
+        c.executemany("DELETE FROM train_locations WHERE train_id = ?", self.train_deletes)
+        c.executemany("DELETE FROM trains WHERE train_id = ?", self.train_deletes)
+        self.tiploc_deletes, self.train_deletes = [], []
+        self.pending_keys.clear()
+
+        c.executemany("INSERT INTO tiplocs (tiploc_id, tiploc_code) VALUES (?, ?)", self.new_tiplocs)
+        c.executemany("UPDATE tiplocs SET station_name = ? WHERE tiploc_id = ?", self.tiploc_names)
+        c.executemany("""
+            INSERT INTO trains (
+                train_id, train_uid, stp_indicator, service_code,
+                runs_on, start_date, end_date, origin_id, destination_id,
+                calendar_start, calendar
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, self.trains)
+        c.executemany("""
+            INSERT OR IGNORE INTO train_locations (
+                train_id, seq, tiploc_id, arrival, departure, platform, activity
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, self.locations)
+
+        flushed = len(self.new_tiplocs) + len(self.trains) + len(self.locations)
+        self.rows_written += flushed
+        self.uncommitted += flushed
+        self.new_tiplocs, self.tiploc_names, self.trains, self.locations = [], [], [], []
+
+        # Keep each transaction bounded so the rollback state stays small
+        if self.commit_every and self.uncommitted >= self.commit_every:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self.conn.commit()
+
+
+def load_timetable(path=TOC_FULL_PATH, db_path=DB_PATH, batch_size=BATCH_SIZE, workers=1,
+                   chunk_size=CHUNK_SIZE, member=None, incremental=False, force=False, keep_tiplocs=None,
+                   fresh=False):
+    """Load a full extract or apply an update. With keep_tiplocs, only schedules calling at one
+    of those TIPLOCs (and the TIPLOCs they use) are stored; updates reuse the stored filter.
+
+    A full load adds to whatever the database already holds. With fresh, the extract is loaded
+    into a new database beside db_path that then replaces it, so nothing from an earlier
+    extract survives and readers never see a half-loaded file.
+    """
+    target = db_path
+    if fresh:
+        if incremental:
+            raise Exception("A fresh load needs a full extract, not an update")
+        db_path = f"{target}.tmp"
+        if os.path.exists(db_path):
+            os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    if fresh:
+        create_schema(conn)
+    if schema_version(conn) != SCHEMA_VERSION:
+        raise Exception(f"{db_path} is not at schema v{SCHEMA_VERSION}; run create_schema.py first")
+    header = read_extract_header(path, member)
+
+    if incremental:
+        stored = stored_ingest_filter(conn)
+        if keep_tiplocs is not None and keep_tiplocs != stored:
+            raise Exception("The TIPLOC filter differs from the one this database was loaded with; "
+                            "reload the full extract to change it")
+        keep_tiplocs = stored
+        if not check_update_sequence(conn, header, force):
+            conn.close()
+            return None
+        # Apply the whole update as one transaction so a failure leaves the database untouched
+        writer = TimetableWriter(conn, batch_size=batch_size, commit_every=None, incremental=True)
+    else:
+        for pragma in BULK_LOAD_PRAGMAS:
+            conn.execute(pragma)
+        # Building the indexes once at the end beats maintaining them row by row
+        drop_indexes(conn)
+        store_ingest_filter(conn, keep_tiplocs)
+        writer = TimetableWriter(conn, batch_size=batch_size)
+
+    start = time.perf_counter()
+
+    def consume(records):
+        for kind, payload in records:
+            if kind == "tiploc":
+                writer.add_tiploc(payload)
+            elif kind == "schedule":
+                writer.add_schedule(*payload)
+            elif kind == "tiploc_delete":
+                writer.delete_tiploc(payload)
+            elif kind == "schedule_delete":
+                writer.delete_schedule(payload)
+
+    # Parser processes only decode; this process remains the single writer
+    if workers > 1:
+        consume(iter_records_parallel(path, workers, chunk_size, member, keep_tiplocs))
+    else:
+        with open_timetable(path, member) as f:
+            consume(iter_records(f, keep_tiplocs))
+
+    writer.flush()
+    pruned = prune_tiplocs(conn) if keep_tiplocs else 0
+    record_applied_extract(conn, header, path, incremental)
+    writer.close()
+    if not incremental:
+        with metrics.section("index_build"):
+            create_indexes(conn)
+    conn.close()
+    if fresh:
+        os.replace(db_path, target)
+
+    metrics.count("tiplocs_in", writer.tiploc_count)
+    metrics.count("schedules_in", writer.train_count)
+    metrics.count("locations_in", writer.location_count)
+    metrics.count("rows_out", writer.rows_written)
+
+    elapsed = time.perf_counter() - start
+    rate = writer.rows_written / elapsed if elapsed > 0 else 0.0
+    print(f"TIPLOCs loaded: {writer.tiploc_count}")
+    print(f"Trains loaded: {writer.train_count}")
+    print(f"Locations loaded: {writer.location_count}")
+    if incremental:
+        print(f"Deletes applied: {writer.delete_count}")
+    if keep_tiplocs:
+        print(f"Filtered to schedules calling at {len(keep_tiplocs)} TIPLOCs; dropped {pruned} unused TIPLOCs")
+    print(f"Wrote {writer.rows_written} rows in {elapsed:.1f}s ({rate:,.0f} rows/sec)")
+    return writer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load TIPLOCs and schedules from toc-full into SQLite.")
+    parser.add_argument("--input", default=default_input(),
+                        help="toc-full JSON lines extract, or the timetable ZIP containing it")
+    parser.add_argument("--member", help="Name of the toc-full member when --input is a ZIP")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database created by create_schema.py")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows buffered per executemany flush")
+    parser.add_argument("--update", action="store_true",
+                        help="Apply a daily update extract to the existing tables instead of a full load")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Load the full extract into a new database that replaces --db, instead of "
+                             "adding to the tables already there")
+    parser.add_argument("--force", action="store_true",
+                        help="With --update, apply the extract even if its sequence number is out of order")
+    parser.add_argument("--keep-tiplocs",
+                        help="Only store schedules calling at these TIPLOCs (comma-separated, or a file "
+                             "with one code per line)")
+    parser.add_argument("--london-only", action="store_true",
+                        help="Only store schedules calling at a London terminal")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Parser processes; 1 parses serially, 0 uses every CPU core")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_SIZE // (1024 * 1024),
+                        help="Size of the byte ranges handed to each parser process")
+    args = parser.parse_args()
+    metrics.start_stage("ingest")
+
+    keep_tiplocs = read_tiploc_filter(args.keep_tiplocs) if args.keep_tiplocs else None
+    if args.london_only:
+        from expected_travel_times import terminal_tiplocs
+        keep_tiplocs = (keep_tiplocs or frozenset()) | {code for codes in terminal_tiplocs.values() for code in codes}
+
+    workers = args.workers or os.cpu_count()
+    load_timetable(args.input, args.db, batch_size=args.batch_size, workers=workers,
+                   chunk_size=args.chunk_mb * 1024 * 1024, member=args.member,
+                   incremental=args.update, force=args.force, keep_tiplocs=keep_tiplocs, fresh=args.fresh)
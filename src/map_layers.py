@@ -0,0 +1,153 @@
+
+###############################################################################
+### Map layers for create_map.py (GeoJSON on a canvas, isochrone overlays) ###
+###############################################################################
+
+import json
+import numpy as np
+import folium
+from branca.element import MacroElement
+from folium.template import Template
+
+
+def stop_features(grouped, terminals):
+    """One GeoJSON point per stop, carrying its minutes from each terminal (null if unserved)."""
+    features = []
+    for stop, lat, lon, stop_terminals, minutes in zip(
+        grouped["stop"], grouped["lat"], grouped["lon"], grouped["terminal"], grouped["expected_minutes"]
+    ):
+        by_terminal = dict(zip(stop_terminals, minutes))
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(float(lon), 5), round(float(lat), 5)]},
+            "properties": {
+                "name": str(stop),
+                "minutes": [round(float(by_terminal[t]), 1) if t in by_terminal else None for t in terminals],
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class StopLayer(MacroElement):
+    """Every stop drawn once as a canvas circle, coloured by its quickest checked terminal.
+
+    The per-terminal checkboxes are handled in the browser: unchecking a terminal recolours
+    the stops and hides those no checked terminal serves, so the HTML holds one feature per
+    stop however many terminals serve it.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var terminals = {{ this.terminals|tojson }};
+            var thresholds = {{ this.thresholds|tojson }};
+            var colors = {{ this.colors|tojson }};
+            var enabled = terminals.map(function() { return true; });
+            var renderer = L.canvas({padding: 0.5});
+            var shown = L.featureGroup().addTo(map);
+
+            function colour(minutes) {
+                var i = 0;
+                while (i < colors.length - 1 && minutes >= thresholds[i + 1]) { i++; }
+                return colors[i];
+            }
+
+            function quickest(minutes) {
+                var best = null;
+                for (var i = 0; i < terminals.length; i++) {
+                    if (enabled[i] && minutes[i] !== null && (best === null || minutes[i] < best)) {
+                        best = minutes[i];
+                    }
+                }
+                return best;
+            }
+
+            function describe(feature) {
+                var rows = [];
+                feature.properties.minutes.forEach(function(m, i) {
+                    if (enabled[i] && m !== null) { rows.push([m, terminals[i]]); }
+                });
+                rows.sort(function(a, b) { return a[0] - b[0]; });
+                return "<b>" + feature.properties.name + "</b>" + rows.map(function(r) {
+                    return "<br>- " + r[1] + ": " + r[0].toFixed(1) + " min";
+                }).join("");
+            }
+
+            var markers = [];
+            L.geoJSON({{ this.data }}, {
+                pointToLayer: function(feature, latlng) {
+                    var marker = L.circleMarker(latlng, {
+                        renderer: renderer, radius: {{ this.radius }}, weight: 1, fillOpacity: 0.8
+                    });
+                    marker.bindTooltip(function() { return describe(feature); });
+                    marker.bindPopup(function() { return describe(feature); }, {maxWidth: 300});
+                    markers.push(marker);
+                    return marker;
+                }
+            });
+
+            function redraw() {
+                markers.forEach(function(marker) {
+                    var best = quickest(marker.feature.properties.minutes);
+                    if (best === null) {
+                        shown.removeLayer(marker);
+                    } else {
+                        marker.setStyle({color: colour(best), fillColor: colour(best)});
+                        shown.addLayer(marker);
+                    }
+                });
+            }
+
+            var control = L.control({position: "topright"});
+            control.onAdd = function() {
+                var div = L.DomUtil.create("div", "leaflet-control-layers leaflet-control-layers-expanded");
+                L.DomEvent.disableClickPropagation(div);
+                terminals.forEach(function(name, i) {
+                    var label = L.DomUtil.create("label", "", div);
+                    var box = L.DomUtil.create("input", "leaflet-control-layers-selector", label);
+                    box.type = "checkbox";
+                    box.checked = true;
+                    box.onchange = function() { enabled[i] = box.checked; redraw(); };
+                    label.appendChild(document.createTextNode(" " + name));
+                });
+                return div;
+            };
+            control.addTo(map);
+            redraw();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, grouped, terminals, colormap, radius=6):
+        super().__init__()
+        self._name = "StopLayer"
+        self.terminals = list(terminals)
+        self.data = json.dumps(stop_features(grouped, self.terminals), separators=(",", ":"))
+        # Step colormap as lower bounds and the colour of each step
+        self.thresholds = [float(t) for t in colormap.index]
+        self.colors = [colormap(t) for t in colormap.index[:-1]]
+        self.radius = radius
+
+
+def isochrone_overlays(isochrones, colormap, opacity=0.45):
+    """One image overlay per isochrone grid, each band filled with the colormap at its upper edge.
+
+    Cells beyond the last band are transparent. Only the all-terminals layer starts visible.
+    """
+    bands = isochrones["bands"]
+    palette = np.zeros((len(bands) + 1, 4), dtype=np.uint8)
+    for i, edge in enumerate(bands):
+        palette[i] = colormap.rgba_bytes_tuple(float(edge))
+        palette[i, 3] = round(255 * opacity)
+
+    south_west, north_east = isochrones["bounds"].tolist()
+    last = len(isochrones["terminals"]) - 1
+    overlays = []
+    for i, (name, grid) in enumerate(zip(isochrones["terminals"], isochrones["grids"])):
+        edges = ", ".join(f"{edge:g}" for edge in bands)
+        overlays.append(folium.raster_layers.ImageOverlay(
+            palette[grid], bounds=[south_west, north_east], origin="upper",
+            name=f"Isochrones: {name} ({edges} min)", show=i == last,
+        ))
+    return overlays
@@ -0,0 +1,175 @@
+
+#############################################################################
+### Per-stage metrics: timings, row counts and peak memory, as JSON lines ###
+#############################################################################
+
+import atexit
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+# Where finished stages append their record; set METRICS_PATH to "" to turn it off
+METRICS_PATH = os.environ.get("METRICS_PATH", "output/metrics/metrics.jsonl")
+# Comma-separated stage or section names to profile with cProfile. Name a stage or some of
+# its sections, not both: only one profiler can be active at a time. Sections run in worker
+# processes are not profiled.
+PROFILE = {name for name in os.environ.get("METRICS_PROFILE", "").split(",") if name}
+PROFILE_DIR = os.environ.get("METRICS_PROFILE_DIR", "output/metrics/profiles")
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(resource.getrusage(who).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _profiling(name):
+    return name in PROFILE
+
+
+class Section:
+    """Accumulated wall and CPU time of a piece of code that may run many times.
+
+    Cheap enough to wrap once per record: two clock reads on entry and two on exit.
+    """
+
+    __slots__ = ("name", "wall", "cpu", "calls", "profile", "_wall", "_cpu")
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+        self.profile = cProfile.Profile() if _profiling(name) else None
+
+    def __enter__(self):
+        if self.profile:
+            self.profile.enable()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.cpu += time.process_time() - self._cpu
+        self.wall += time.perf_counter() - self._wall
+        self.calls += 1
+        if self.profile:
+            self.profile.disable()
+
+    def as_dict(self):
+        return {"wall_s": round(self.wall, 4), "cpu_s": round(self.cpu, 4), "calls": self.calls}
+
+
+# Sections and counts of this process, whether or not a stage has been started
+_sections = {}
+_counts = {}
+_stage = None
+
+
+def section(name):
+    """The named section of this process, for use as `with section("json_decode"): ...`."""
+    s = _sections.get(name)
+    if s is None:
+        s = _sections[name] = Section(name)
+    return s
+
+
+def count(name, n=1):
+    """Add n to a row counter, e.g. count("rows_out", len(df))."""
+    _counts[name] = _counts.get(name, 0) + n
+
+
+def take_sections():
+    """Hand this process's section totals to another process (see merge_sections), and reset them.
+
+    Totals are reset in place, since modules keep references to their sections.
+    """
+    taken = {}
+    for name, s in _sections.items():
+        if s.calls:
+            taken[name] = (s.wall, s.cpu, s.calls)
+        s.wall, s.cpu, s.calls = 0.0, 0.0, 0
+    return taken
+
+
+def merge_sections(taken):
+    """Add section totals from a worker process; times are summed over processes."""
+    for name, (wall, cpu, calls) in taken.items():
+        s = section(name)
+        s.wall += wall
+        s.cpu += cpu
+        s.calls += calls
+
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.now(timezone.utc)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.status = "ok"
+        self.profile = None
+        if _profiling(name):
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def record(self):
+        return {
+            "stage": self.name,
+            "status": self.status,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_s": round(time.perf_counter() - self.wall, 3),
+            "cpu_s": round(time.process_time() - self.cpu, 3),
+            "peak_rss_mb": _peak_rss_mb(),
+            "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+            "counts": dict(_counts),
+            "sections": {name: s.as_dict() for name, s in _sections.items() if s.calls},
+            "argv": sys.argv[1:],
+            "pid": os.getpid(),
+        }
+
+    def dump_profiles(self):
+        profiles = [(self.name, self.profile)] + [(f"{self.name}.{s.name}", s.profile) for s in _sections.values()]
+        for name, profile in profiles:
+            if profile is None:
+                continue
+            profile.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{name}.{self.started:%Y%m%d-%H%M%S}.prof")
+            profile.dump_stats(path)
+            print(f"Profile written to {path} (view with: python -m pstats {path})")
+
+
+def start_stage(name):
+    """Time this script as the named stage; its record is written when the process exits."""
+    global _stage
+    _stage = StageMetrics(name)
+
+    previous_hook = sys.excepthook
+
+    def record_failure(*exc_info):
+        _stage.status = "error"
+        previous_hook(*exc_info)
+
+    sys.excepthook = record_failure
+    atexit.register(finish_stage)
+    return _stage
+
+
+def finish_stage():
+    """Write the stage's record as one JSON line (and any profiles). Runs once, at exit."""
+    global _stage
+    if _stage is None:
+        return None
+    stage, _stage = _stage, None
+    stage.dump_profiles()
+    record = stage.record()
+    if METRICS_PATH:
+        os.makedirs(os.path.dirname(METRICS_PATH) or ".", exist_ok=True)
+        # One short append per stage, so concurrent stages do not interleave within a line
+        with open(METRICS_PATH, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    return record
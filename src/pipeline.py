@@ -0,0 +1,297 @@
+
+##############################################################################
+### Runs the pipeline stages, skipping those whose inputs have not changed ###
+##############################################################################
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = "output/cache/pipeline_state.json"
+HASH_CHUNK = 1024 * 1024
+
+
+class Stage:
+    """One step of the pipeline: scripts run in order, reading inputs and writing outputs (paths
+    relative to the repo root). Optional inputs may be absent; their absence is part of the hash.
+
+    A stage marked always runs on every pipeline run, for scripts that check something outside
+    the tree (later stages still rerun only if its outputs' contents changed). Stages sharing
+    a lock never run at the same time."""
+
+    def __init__(self, name, commands, inputs=(), outputs=(), optional_inputs=(), always=False, lock=None):
+        self.name = name
+        self.commands = [list(c) for c in commands]
+        self.inputs = list(inputs)
+        self.optional_inputs = list(optional_inputs)
+        self.outputs = list(outputs)
+        self.always = always
+        self.lock = lock
+
+    def scripts(self):
+        return [c[0] for c in self.commands]
+
+    def argvs(self, stage_args):
+        """Each script's arguments, with any extra arguments passed to the last (main) script."""
+        return self.commands[:-1] + [self.commands[-1] + list(stage_args)]
+
+
+STAGES = [
+    # Asks the server whether the feed changed (a 304 leaves the ZIP, and so its hash, as it was)
+    Stage("download", [["download_timetable.py"]], outputs=["data/timetable.zip"], always=True),
+    # The loader's INSERT OR IGNORE would merge a new extract into the old tables, so each run
+    # builds a fresh database (schema included) and swaps it in
+    Stage("load", [["load_timetable_json.py", "--input", "data/timetable.zip", "--fresh"]],
+          inputs=["data/timetable.zip"], outputs=["db/timetable.db"]),
+    Stage("extract", [["get_london_terminal_services.py"]],
+          inputs=["db/timetable.db"], outputs=["output/london_trains.feather"]),
+    Stage("travel_times", [["expected_travel_times.py"]],
+          inputs=["db/timetable.db"],
+          outputs=["output/expected_times_to_stops.feather"]),
+    # Each geocoder keeps Nominatim's one request per second only within its own process
+    Stage("geocode_terminals", [["geocode_terminals.py"]],
+          optional_inputs=["data/station_reference.csv"], outputs=["output/london_terminals_geocoded.feather"],
+          lock="nominatim"),
+    Stage("geocode_stations", [["geocode_stations.py"]],
+          inputs=["output/expected_times_to_stops.feather", "db/timetable.db"],
+          optional_inputs=["data/station_reference.csv"],
+          outputs=["output/expected_time_to_stops_geocoded.feather"], lock="nominatim"),
+    Stage("map", [["create_map.py"]],
+          inputs=["output/expected_time_to_stops_geocoded.feather", "output/london_terminals_geocoded.feather"],
+          outputs=["output/london_commuter_stations.html"]),
+]
+
+
+# --- Hashing ---
+class Hasher:
+    """Content hashes of files, reusing the previous run's hash while size and mtime are unchanged."""
+
+    def __init__(self, known):
+        self.known = known
+        self.lock = threading.Lock()
+
+    def file(self, path):
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.known.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_CHUNK), b""):
+                digest.update(block)
+        with self.lock:
+            self.known[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+
+def local_modules(script, seen=None):
+    """The script and every src/ module it imports, directly or through other src/ modules."""
+    seen = set() if seen is None else seen
+    path = os.path.join(SRC_DIR, script)
+    if script in seen or not os.path.exists(path):
+        return seen
+    seen.add(script)
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in ast.walk(tree):
+        names = []
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        for name in names:
+            local_modules(name.split(".")[0] + ".py", seen)
+    return seen
+
+
+def stage_key(stage, hasher, stage_args):
+    """Digest of what a stage's outputs depend on: its code, arguments and input files."""
+    parts = {
+        "commands": stage.argvs(stage_args),
+        "code": {m: hasher.file(os.path.join(SRC_DIR, m))
+                 for s in stage.scripts() for m in sorted(local_modules(s))},
+        "inputs": {p: hasher.file(p) for p in stage.inputs + stage.optional_inputs},
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+# --- State ---
+def load_state(path=STATE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": {}, "stages": {}}
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def up_to_date(stage, key, state, hasher):
+    """Same key as the last successful run, and every output still as that run left it."""
+    recorded = state["stages"].get(stage.name)
+    if not recorded or recorded["key"] != key:
+        return False
+    return all(hasher.file(p) is not None and hasher.file(p) == recorded["outputs"].get(p) for p in stage.outputs)
+
+
+# --- Running ---
+def dependencies(stages, skip=()):
+    """stage name -> names of the stages producing its inputs (none for skipped stages)."""
+    producers = {p: s.name for s in stages for p in s.outputs}
+    return {
+        s.name: set() if s.name in skip else
+        {producers[p] for p in s.inputs + s.optional_inputs if p in producers and producers[p] != s.name}
+        for s in stages
+    }
+
+
+def select(stages, targets, skip=()):
+    """The target stages and everything upstream of them, in pipeline order."""
+    by_name = {s.name: s for s in stages}
+    unknown = [t for t in list(targets) + list(skip) if t not in by_name]
+    if unknown:
+        raise Exception(f"Unknown stage(s): {', '.join(unknown)}. Stages: {', '.join(by_name)}")
+    if not targets:
+        return stages
+    deps = dependencies(stages, skip)
+    wanted, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+    return [s for s in stages if s.name in wanted]
+
+
+def run_commands(stage, stage_args, print_lock):
+    """Run a stage's scripts from the repo root, prefixing their output with the stage name."""
+    for command in stage.argvs(stage_args):
+        argv = [sys.executable, os.path.join(SRC_DIR, command[0])] + command[1:]
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        for line in proc.stdout:
+            with print_lock:
+                print(f"[{stage.name}] {line}", end="", flush=True)
+        if proc.wait() != 0:
+            raise Exception(f"{stage.name}: {command[0]} exited with status {proc.returncode}")
+
+
+def run_pipeline(stages=STAGES, targets=(), force=(), skip=(), stage_args=None, jobs=None, dry_run=False,
+                 state_path=STATE_PATH):
+    """Run the selected stages, each once its upstream stages are done, skipping any that are up to date.
+
+    Stages whose dependencies are satisfied run concurrently (up to jobs at a time), except
+    those holding the same lock. Stages in skip are not run at all; their existing outputs are
+    used as they are. A dry run cannot tell whether an always stage will change its outputs, so
+    it judges the stages after one on the files as they stand.
+    Returns {stage name: 'ran' | 'skipped' | 'would run' | 'failed' | 'blocked'}.
+    """
+    stage_args = stage_args or {}
+    stages = select(stages, list(targets), skip)
+    by_name = {s.name: s for s in stages}
+    deps = dependencies(stages, skip)
+    state = load_state(state_path)
+    hasher = Hasher(state["files"])
+    state_lock, print_lock = threading.Lock(), threading.Lock()
+    status = {}
+
+    def process(stage):
+        args = stage_args.get(stage.name, [])
+        if stage.name in skip:
+            missing = [p for p in stage.outputs if not os.path.exists(p)]
+            if missing:
+                raise Exception(f"{stage.name} is skipped but {', '.join(missing)} does not exist")
+            return "skipped"
+        key = stage_key(stage, hasher, args)
+        if dry_run and any(status.get(d) == "would run" and not by_name[d].always for d in deps[stage.name]):
+            return "would run"
+        if stage.name not in force and not stage.always and up_to_date(stage, key, state, hasher):
+            return "skipped"
+        if dry_run:
+            return "would run"
+        run_commands(stage, args, print_lock)
+        missing = [p for p in stage.outputs if not os.path.exists(p)]
+        if missing:
+            raise Exception(f"{stage.name} did not write {', '.join(missing)}")
+        # Inputs are hashed again in case the stage itself touched them
+        with state_lock:
+            state["stages"][stage.name] = {"key": stage_key(stage, hasher, args),
+                                           "outputs": {p: hasher.file(p) for p in stage.outputs}}
+            save_state(state, state_path)
+        return "ran"
+
+    pending = {s.name: s for s in stages}
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs or len(stages) or 1) as pool:
+        while pending or running:
+            held = {by_name[name].lock for name in running.values()}
+            for name in list(pending):
+                lock = by_name[name].lock
+                if any(status.get(d) in ("failed", "blocked") for d in deps[name]):
+                    status[name] = "blocked"
+                    del pending[name]
+                elif all(d in status for d in deps[name]) and (lock is None or lock not in held):
+                    running[pool.submit(process, pending.pop(name))] = name
+                    held.add(lock)
+            if not running:
+                if pending:
+                    raise Exception(f"Stages depend on each other: {', '.join(pending)}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    status[name] = future.result()
+                except Exception as e:
+                    status[name] = "failed"
+                    with print_lock:
+                        print(f"[{name}] FAILED: {e}", flush=True)
+                with print_lock:
+                    print(f"[{name}] {status[name]}", flush=True)
+
+    with state_lock:
+        save_state(state, state_path)
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline, skipping stages whose code, arguments "
+                                                 "and inputs are unchanged since they last ran.")
+    parser.add_argument("targets", nargs="*",
+                        help=f"Stages to bring up to date, with their upstream stages (default: all of "
+                             f"{', '.join(s.name for s in STAGES)})")
+    parser.add_argument("--force", action="append", default=[], help="Run this stage even if it is up to date")
+    parser.add_argument("--skip", action="append", default=[],
+                        help="Do not run this stage; use its existing outputs (e.g. download on an offline host)")
+    parser.add_argument("--args", action="append", default=[], metavar="STAGE=ARGS",
+                        help='Extra arguments for a stage\'s scripts, e.g. travel_times="--step 5"')
+    parser.add_argument("--jobs", type=int, help="Stages run at once (default: as many as are ready)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages would run")
+    args = parser.parse_args()
+
+    stage_args = {}
+    for item in args.args:
+        name, _, extra = item.partition("=")
+        stage_args[name] = shlex.split(extra)
+
+    status = run_pipeline(targets=args.targets, force=set(args.force), skip=set(args.skip), stage_args=stage_args,
+                          jobs=args.jobs, dry_run=args.dry_run)
+    print("Pipeline: " + ", ".join(f"{name} {result}" for name, result in status.items()))
+    if any(result in ("failed", "blocked") for result in status.values()):
+        sys.exit(1)
@@ -0,0 +1,126 @@
+
+################################################################################
+### Offline station geocoding from a local reference file (NaPTAN/CRS style) ###
+################################################################################
+
+import os
+import sqlite3
+import pandas as pd
+
+REFERENCE_PATH = "data/station_reference.csv"
+DB_PATH = "db/timetable.db"
+
+# Accepted spellings of each reference column, e.g. NaPTAN RailReferences/Stops or a plain export
+COLUMN_ALIASES = {
+    "tiploc_code": ["tiploc_code", "TiplocCode", "tiploc", "TIPLOC"],
+    "crs_code": ["crs_code", "CrsCode", "crs", "CRS"],
+    "name": ["name", "StationName", "station_name", "CommonName", "stop"],
+    "lat": ["lat", "Latitude", "latitude"],
+    "lon": ["lon", "Longitude", "longitude", "lng"],
+    "easting": ["easting", "Easting"],
+    "northing": ["northing", "Northing"],
+}
+
+NAME_SUFFIXES = r"\s+(RAIL STATION|RAILWAY STATION|STATION)$"
+
+
+def normalise_names(names):
+    """Upper-case station names with punctuation, '&' and 'Rail Station' suffixes smoothed out."""
+    return (
+        pd.Series(names, dtype="string").str.upper()
+          .str.replace("&", " AND ", regex=False)
+          .str.replace(r"[^A-Z0-9()]+", " ", regex=True)
+          .str.replace(r"\(\s*", "(", regex=True)
+          .str.replace(r"\s*\)", ")", regex=True)
+          .str.strip()
+          .str.replace(NAME_SUFFIXES, "", regex=True)
+          .str.replace(r"\s+", " ", regex=True)
+    )
+
+
+def _grid_to_lat_lon(easting, northing):
+    try:
+        from pyproj import Transformer
+    except ImportError:
+        raise Exception("Reference file has only Easting/Northing; install pyproj or add Latitude/Longitude columns")
+    lon, lat = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True).transform(easting, northing)
+    return lat, lon
+
+
+def load_station_reference(path=REFERENCE_PATH):
+    """Station coordinates as tiploc_code, crs_code, name_key, lat, lon (one row per reference row)."""
+    raw = pd.read_csv(path, dtype=str)
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        found = next((alias for alias in aliases if alias in raw.columns), None)
+        if found:
+            columns[column] = raw[found]
+    if "name" not in columns and "tiploc_code" not in columns and "crs_code" not in columns:
+        raise Exception(f"{path} has no station name, TIPLOC or CRS column")
+
+    reference = pd.DataFrame({
+        "tiploc_code": columns.get("tiploc_code"),
+        "crs_code": columns.get("crs_code"),
+        "name_key": normalise_names(columns["name"]) if "name" in columns else None,
+    }, index=raw.index)
+    for code in ["tiploc_code", "crs_code"]:
+        reference[code] = reference[code].astype("string").str.strip().str.upper()
+
+    if "lat" in columns and "lon" in columns:
+        reference["lat"] = pd.to_numeric(columns["lat"], errors="coerce")
+        reference["lon"] = pd.to_numeric(columns["lon"], errors="coerce")
+    elif "easting" in columns and "northing" in columns:
+        reference["lat"], reference["lon"] = _grid_to_lat_lon(
+            pd.to_numeric(columns["easting"], errors="coerce").to_numpy(),
+            pd.to_numeric(columns["northing"], errors="coerce").to_numpy(),
+        )
+    else:
+        raise Exception(f"{path} has neither Latitude/Longitude nor Easting/Northing columns")
+    return reference.dropna(subset=["lat", "lon"]).reset_index(drop=True)
+
+
+def stop_tiplocs(db_path=DB_PATH):
+    """stop (station name) -> tiploc_code, one row per TIPLOC carrying the name."""
+    if not os.path.exists(db_path):
+        return pd.DataFrame(columns=["stop", "tiploc_code"])
+    with sqlite3.connect(db_path) as conn:
+        return pd.read_sql_query(
+            "SELECT station_name AS stop, tiploc_code FROM tiplocs WHERE station_name IS NOT NULL", conn
+        )
+
+
+def _first_match(keys, reference, key):
+    """Coordinates for each key from the first reference row with that key (NaN if none)."""
+    index = reference.dropna(subset=[key]).drop_duplicates(key).set_index(key)[["lat", "lon"]]
+    return index.reindex(keys)
+
+
+def offline_geocode(stops, reference, tiplocs=None):
+    """lat/lon for each stop name, matched by TIPLOC (via the timetable's tiplocs table),
+    then as a TIPLOC or CRS code itself, then by normalised name. Unmatched stops get NaN.
+
+    stops is a sequence of names; tiplocs a stop -> tiploc_code frame from stop_tiplocs.
+    """
+    result = pd.DataFrame({"stop": pd.Series(stops, dtype=object).drop_duplicates().to_numpy()})
+    result["lat"] = float("nan")
+    result["lon"] = float("nan")
+
+    def fill(matched):
+        missing = result["lat"].isna().to_numpy() & matched["lat"].notna().to_numpy()
+        result.loc[missing, ["lat", "lon"]] = matched.loc[missing, ["lat", "lon"]].to_numpy()
+
+    names = result["stop"].astype(str).str.upper()
+    if tiplocs is not None and len(tiplocs) and reference["tiploc_code"].notna().any():
+        by_tiploc = tiplocs.assign(
+            stop=tiplocs["stop"].astype(str).str.upper(),
+            tiploc_code=tiplocs["tiploc_code"].str.upper(),
+        ).merge(_first_match(tiplocs["tiploc_code"].str.upper().unique(), reference, "tiploc_code"),
+                left_on="tiploc_code", right_index=True).dropna(subset=["lat"])
+        fill(by_tiploc.drop_duplicates("stop").set_index("stop").reindex(names).reset_index(drop=True))
+    # Stops named by a code: unnamed TIPLOCs fall back to their code in connection_scan.py
+    for key in ["tiploc_code", "crs_code"]:
+        if reference[key].notna().any():
+            fill(_first_match(names, reference, key).reset_index(drop=True))
+    if reference["name_key"].notna().any():
+        fill(_first_match(normalise_names(names), reference, "name_key").reset_index(drop=True))
+    return result
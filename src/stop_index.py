@@ -0,0 +1,232 @@
+
+###########################################################################
+### Spatial index over the geocoded stops, joined to their travel times ###
+###########################################################################
+
+import argparse
+import math
+import numpy as np
+import pandas as pd
+from frames import read_frame, write_frame
+
+GEOCODED_PATH = "output/expected_time_to_stops_geocoded.feather"
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_CELL_KM = 2.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km, elementwise over arrays of degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _ranges(starts, lengths):
+    """Concatenation of arange(start, start + length) for each pair, without a Python loop."""
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(offsets.size) - offsets + np.repeat(starts, lengths)
+
+
+def stop_table(geocoded):
+    """One row per stop (stop, lat, lon, best_minutes, best_terminal) and its minutes from each terminal.
+
+    geocoded has a row per (terminal, stop), as written by geocode_stations.py.
+    """
+    df = geocoded.dropna(subset=["lat", "lon"]).assign(terminal=lambda d: d["terminal"].astype(str),
+                                                      stop=lambda d: d["stop"].astype(str))
+    minutes = df.pivot_table(index="stop", columns="terminal", values="expected_minutes")
+    stops = df.groupby("stop")[["lat", "lon"]].first().reindex(minutes.index)
+    stops["best_minutes"] = minutes.min(axis=1)
+    stops["best_terminal"] = minutes.idxmin(axis=1)
+    return stops.reset_index(), minutes.reset_index(drop=True)
+
+
+class StopIndex:
+    """Stops bucketed into a grid of roughly cell_km squares for radius, nearest and box queries.
+
+    Points are sorted by cell (row-major), so the cells a query box overlaps in one grid row
+    are a single slice. Queries take arrays of points and are answered together: every
+    (query, candidate) pair is generated with array arithmetic and then checked exactly with
+    the haversine distance. Longitudes are assumed not to wrap around the antimeridian.
+    """
+
+    def __init__(self, stops, minutes=None, cell_km=DEFAULT_CELL_KM):
+        lat = stops["lat"].to_numpy(float)
+        lon = stops["lon"].to_numpy(float)
+        self.cell_km = cell_km
+        self.dlat = math.degrees(cell_km / EARTH_RADIUS_KM)
+        if len(lat):
+            self.south, self.west = lat.min(), lon.min()
+            self.dlon = self.dlat / math.cos(math.radians(float(np.mean(lat))))
+            self.n_rows = int((lat.max() - self.south) // self.dlat) + 1
+            self.n_cols = int((lon.max() - self.west) // self.dlon) + 1
+        else:
+            # No stops (e.g. none within reach): an empty grid, so every query finds nothing
+            self.south = self.west = 0.0
+            self.dlon = self.dlat
+            self.n_rows = self.n_cols = 0
+
+        cell = self._row(lat) * self.n_cols + self._col(lon)
+        order = np.argsort(cell, kind="stable")
+        self.stops = stops.iloc[order].reset_index(drop=True)
+        self.minutes = minutes.iloc[order].reset_index(drop=True) if minutes is not None else None
+        self.lat, self.lon = lat[order], lon[order]
+        self.cell_start = np.searchsorted(cell[order], np.arange(self.n_rows * self.n_cols + 1))
+
+    @classmethod
+    def from_geocoded(cls, geocoded, cell_km=DEFAULT_CELL_KM):
+        stops, minutes = stop_table(geocoded)
+        return cls(stops, minutes, cell_km)
+
+    def _row(self, lat):
+        return np.floor((lat - self.south) / self.dlat).astype(np.int64)
+
+    def _col(self, lon):
+        return np.floor((lon - self.west) / self.dlon).astype(np.int64)
+
+    def reachable(self, max_minutes, terminals=None):
+        """A smaller index of the stops within max_minutes of any of the terminals (default all)."""
+        minutes = self.minutes
+        if terminals:
+            unknown = [t for t in terminals if t not in minutes.columns]
+            if unknown:
+                raise Exception(f"No travel times from {', '.join(unknown)}")
+            minutes = minutes[list(terminals)]
+        best = minutes.min(axis=1)
+        keep = (best <= max_minutes).to_numpy()
+        stops = self.stops[keep].assign(best_minutes=best[keep].to_numpy(),
+                                        best_terminal=minutes[keep].idxmin(axis=1).to_numpy())
+        return StopIndex(stops, minutes[keep], self.cell_km)
+
+    # --- Queries ---
+    def _candidates(self, south, west, north, east):
+        """(query, point) pairs for every point in the cells overlapping each query's box."""
+        r0 = np.clip(self._row(south), 0, self.n_rows)
+        r1 = np.clip(self._row(north), -1, self.n_rows - 1)
+        c0 = np.clip(self._col(west), 0, self.n_cols)
+        c1 = np.clip(self._col(east), -1, self.n_cols - 1)
+        n_rows = np.where(c1 >= c0, np.maximum(r1 - r0 + 1, 0), 0)
+
+        q = np.repeat(np.arange(len(r0)), n_rows)
+        row = _ranges(r0, n_rows)
+        first = self.cell_start[row * self.n_cols + c0[q]]
+        lengths = self.cell_start[row * self.n_cols + c1[q] + 1] - first
+        return np.repeat(q, lengths), _ranges(first, lengths)
+
+    def radius_pairs(self, lats, lons, km):
+        """(query, point, distance_km) for every point within km (scalar or per query) of each query."""
+        lats, lons = np.atleast_1d(np.asarray(lats, float)), np.atleast_1d(np.asarray(lons, float))
+        km = np.broadcast_to(np.asarray(km, float), lats.shape)
+        d = km / EARTH_RADIUS_KM
+        reach_lat = np.degrees(d)
+        # Widest longitude on the circle; circles reaching over a pole span every longitude
+        covers_pole = d >= np.pi / 2 - np.radians(np.abs(lats))
+        ratio = np.sin(np.minimum(d, np.pi / 2)) / np.maximum(np.cos(np.radians(lats)), 1e-12)
+        reach_lon = np.where(covers_pole, 360.0, np.degrees(np.arcsin(np.minimum(ratio, 1.0))))
+
+        query, point = self._candidates(lats - reach_lat, lons - reach_lon, lats + reach_lat, lons + reach_lon)
+        distance = haversine_km(lats[query], lons[query], self.lat[point], self.lon[point])
+        keep = distance <= km[query]
+        return query[keep], point[keep], distance[keep]
+
+    def _frame(self, query, point, distance, rank=None):
+        order = np.lexsort((distance, query))
+        out = self.stops.iloc[point[order]].reset_index(drop=True)
+        out.insert(0, "query", query[order])
+        if rank is not None:
+            out.insert(1, "rank", rank[order])
+        out["distance_km"] = distance[order].round(3)
+        return out
+
+    def radius(self, lats, lons, km):
+        """Stops within km of each query point, nearest first, with the query's row number."""
+        return self._frame(*self.radius_pairs(lats, lons, km))
+
+    def nearest(self, lats, lons, k=1, max_km=None):
+        """The k nearest stops to each query point (optionally no further than max_km).
+
+        Searches a radius expected to hold k stops and doubles it for the queries that found
+        fewer; a query is settled once its circle holds k stops, as none outside can be closer.
+        """
+        lats, lons = np.atleast_1d(np.asarray(lats, float)), np.atleast_1d(np.asarray(lons, float))
+        k = min(k, len(self.stops))
+        limit = max_km if max_km is not None else math.pi * EARTH_RADIUS_KM
+        km = min(limit, self.cell_km * math.sqrt(k))
+        pending = np.arange(len(lats))
+        # Starts empty of pairs, so no query points give an empty frame
+        found = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))]
+        while len(pending):
+            query, point, distance = self.radius_pairs(lats[pending], lons[pending], km)
+            settled = (np.bincount(query, minlength=len(pending)) >= k) | (km >= limit)
+            keep = settled[query]
+            found.append((pending[query[keep]], point[keep], distance[keep]))
+            pending = pending[~settled]
+            km = min(limit, km * 2)
+
+        query, point, distance = (np.concatenate(parts) for parts in zip(*found))
+        order = np.lexsort((distance, query))
+        query, point, distance = query[order], point[order], distance[order]
+        starts = np.searchsorted(query, query, side="left")
+        rank = np.arange(len(query)) - starts
+        keep = rank < k
+        return self._frame(query[keep], point[keep], distance[keep], rank[keep] + 1)
+
+    def within_box(self, south, west, north, east):
+        """Stops inside a latitude/longitude box, from north-west to south-east."""
+        _, point = self._candidates(np.array([south]), np.array([west]), np.array([north]), np.array([east]))
+        point = point[(self.lat[point] >= south) & (self.lat[point] <= north)
+                      & (self.lon[point] >= west) & (self.lon[point] <= east)]
+        point = point[np.lexsort((self.lon[point], -self.lat[point]))]
+        return self.stops.iloc[point].reset_index(drop=True)
+
+
+def load_stop_index(path=GEOCODED_PATH, cell_km=DEFAULT_CELL_KM):
+    return StopIndex.from_geocoded(read_frame(path), cell_km)
+
+
+def parse_floats(text, n):
+    values = [float(v) for v in text.split(",")]
+    if len(values) != n:
+        raise Exception(f"Expected {n} comma-separated numbers, got {text!r}")
+    return values
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find geocoded stops by distance, optionally limited to those "
+                                                 "within some minutes of the terminals.")
+    parser.add_argument("--input", default=GEOCODED_PATH, help="Output of geocode_stations.py")
+    parser.add_argument("--point", action="append", default=[], metavar="LAT,LON", help="Query point, repeatable")
+    parser.add_argument("--points", help="Feather or CSV file of query points with lat and lon columns "
+                                         "(e.g. postcode centroids); results refer to its rows by number")
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--radius", type=float, metavar="KM", help="Stops within this distance of each point")
+    query.add_argument("--nearest", type=int, metavar="K", help="The K nearest stops to each point")
+    query.add_argument("--box", metavar="SOUTH,WEST,NORTH,EAST", help="Stops inside this box")
+    parser.add_argument("--max-minutes", type=float, help="Only stops within this many minutes of a terminal")
+    parser.add_argument("--terminal", action="append", help="Terminals counted by --max-minutes (default all)")
+    parser.add_argument("--cell-km", type=float, default=DEFAULT_CELL_KM, help="Grid cell size")
+    parser.add_argument("--output", help="Write the matches here (Feather) instead of printing them")
+    args = parser.parse_args()
+
+    index = load_stop_index(args.input, args.cell_km)
+    if args.max_minutes is not None:
+        index = index.reachable(args.max_minutes, args.terminal)
+
+    if args.box:
+        matches = index.within_box(*parse_floats(args.box, 4))
+    else:
+        points = [parse_floats(p, 2) for p in args.point]
+        if args.points:
+            points += read_frame(args.points, columns=["lat", "lon"])[["lat", "lon"]].to_numpy().tolist()
+        if not points and not args.points:
+            raise Exception("Give query points with --point or --points")
+        lats, lons = np.array(points, dtype=float).reshape(-1, 2).T
+        matches = (index.radius(lats, lons, args.radius) if args.radius is not None
+                   else index.nearest(lats, lons, args.nearest))
+
+    if args.output:
+        print(f"{len(matches)} matches saved to {write_frame(matches, args.output)}")
+    else:
+        with pd.option_context("display.max_rows", 200, "display.width", 160):
+            print(matches)
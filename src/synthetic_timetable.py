@@ -0,0 +1,290 @@
+
+#####################################################################################
+### Synthetic toc-full timetable at any scale, for benchmarking without the feed ###
+#####################################################################################
+
+import argparse
+import csv
+import json
+import math
+import os
+import random
+from datetime import date, timedelta
+
+from expected_travel_times import terminal_tiplocs
+
+PERIOD_START = date(2026, 5, 17)
+PERIOD_END = date(2026, 12, 12)
+
+# Rough positions of the terminals (the first TIPLOC of each in terminal_tiplocs)
+TERMINAL_POSITIONS = {
+    'LONDON BLACKFRIARS': (51.5118, -0.1033),
+    'LONDON CANNON STREET': (51.5113, -0.0904),
+    'LONDON CHARING CROSS': (51.5080, -0.1247),
+    'LONDON EUSTON': (51.5282, -0.1337),
+    'LONDON FENCHURCH STREET': (51.5116, -0.0789),
+    'LONDON KINGS CROSS': (51.5308, -0.1238),
+    'LONDON LIVERPOOL STREET': (51.5178, -0.0823),
+    'LONDON BRIDGE': (51.5052, -0.0864),
+    'LONDON MARYLEBONE': (51.5225, -0.1631),
+    'LONDON PADDINGTON': (51.5154, -0.1755),
+    'LONDON ST PANCRAS': (51.5322, -0.1264),
+    'LONDON VICTORIA': (51.4952, -0.1441),
+    'LONDON WATERLOO': (51.5031, -0.1132),
+}
+
+# Share of schedules by STP indicator, roughly as in the real extract
+STP_MIX = [("P", 0.62), ("O", 0.24), ("C", 0.09), ("N", 0.05)]
+DAY_PATTERNS = [("1111100", 0.55), ("0000010", 0.2), ("0000001", 0.15), ("1111110", 0.1)]
+# Share of services that never reach a terminal (cross-country and local)
+CROSS_COUNTRY_SHARE = 0.3
+# Stopping patterns: probability of calling at an intermediate station
+STOPPING_PATTERNS = [(1.0, 0.45), (0.5, 0.35), (0.2, 0.2)]
+
+KM_PER_DEG_LAT = 110.57
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def hhmm(minutes, half=False):
+    minutes = int(minutes) % 1440
+    return f"{minutes // 60:02d}{minutes % 60:02d}" + ("H" if half else "")
+
+
+# --- Network ---
+def build_network(rng, n_stations):
+    """Terminals with radial branches of stations and junctions, plus cross-country routes.
+
+    Returns (tiplocs, routes): tiplocs maps code -> (name, lat, lon, is_station); routes are
+    lists of codes, London routes starting at a terminal.
+    """
+    tiplocs = {}
+    terminals = []
+    for terminal, codes in terminal_tiplocs.items():
+        lat, lon = TERMINAL_POSITIONS[terminal]
+        for code in codes:
+            tiplocs[code] = (terminal, lat, lon, True)
+        terminals.append((codes[0], lat, lon))
+
+    station_count = junction_count = 0
+    routes = []
+    branches_per_terminal = max(2, round(n_stations / len(terminals) / 25))
+    per_branch = max(3, n_stations // (len(terminals) * branches_per_terminal))
+    for t, (code, lat0, lon0) in enumerate(terminals):
+        base_angle = 2 * math.pi * t / len(terminals)
+        trunk = []
+        for b in range(branches_per_terminal):
+            angle = base_angle + rng.uniform(-0.35, 0.35)
+            # Branches share the first stretch of line out of the terminal
+            route = [code] + trunk
+            distance = 2.0 + 3.0 * len(trunk)
+            for _ in range(per_branch - len(trunk)):
+                distance += rng.uniform(2.0, 6.0)
+                lat = lat0 + distance * math.cos(angle) / KM_PER_DEG_LAT
+                lon = lon0 + distance * math.sin(angle) / (KM_PER_DEG_LAT * math.cos(math.radians(lat0)))
+                if rng.random() < 0.15:
+                    junction = f"JN{junction_count:05d}"
+                    junction_count += 1
+                    tiplocs[junction] = (f"JUNCTION {junction[2:]}", lat, lon, False)
+                    route.append(junction)
+                station = f"SYN{station_count:05d}"
+                station_count += 1
+                tiplocs[station] = (f"STATION {station[3:]}", lat, lon, True)
+                route.append(station)
+            if b == 0:
+                trunk = route[1:1 + per_branch // 3]
+            routes.append(route)
+
+    # Cross-country routes link stations part-way out on different branches
+    stations = [code for code, (_, _, _, is_station) in tiplocs.items() if is_station and code.startswith("SYN")]
+    for _ in range(max(1, len(routes) // 2)):
+        routes.append(rng.sample(stations, min(len(stations), rng.randint(4, 15))))
+    return tiplocs, routes
+
+
+# --- Schedules ---
+def schedule_locations(rng, route, depart, stop_share):
+    """schedule_location list along the route, with public times at calls and pass times elsewhere."""
+    # Trains start and end at stations, not junctions
+    while route[0].startswith("JN"):
+        route = route[1:]
+    while route[-1].startswith("JN"):
+        route = route[:-1]
+    locations = []
+    time = depart
+    last = len(route) - 1
+    for i, code in enumerate(route):
+        calls = i in (0, last) or (not code.startswith("JN") and rng.random() < stop_share)
+        loc = {
+            "location_type": "LO" if i == 0 else ("LT" if i == last else "LI"),
+            "record_identity": "LO" if i == 0 else ("LT" if i == last else "LI"),
+            "tiploc_code": code,
+            "tiploc_instance": None,
+            "arrival": None, "departure": None, "pass": None,
+            "public_arrival": None, "public_departure": None,
+            "platform": str(rng.randint(1, 12)) if calls else None,
+            "line": None, "path": None,
+            "engineering_allowance": None, "pathing_allowance": None, "performance_allowance": None,
+        }
+        if i > 0:
+            time += rng.uniform(1.5, 5.0)
+        if not calls:
+            loc["pass"] = hhmm(time, half=rng.random() < 0.5)
+        else:
+            if i > 0:
+                loc["arrival"] = hhmm(time, half=rng.random() < 0.3)
+                loc["public_arrival"] = hhmm(time)
+                time += 1
+            if i < last:
+                loc["departure"] = hhmm(time)
+                loc["public_departure"] = hhmm(time)
+        locations.append(loc)
+    return locations
+
+
+def schedule_record(uid, stp, start, end, days, locations, service_code):
+    return {"JsonScheduleV1": {
+        "CIF_bank_holiday_running": None,
+        "CIF_stp_indicator": stp,
+        "CIF_train_uid": uid,
+        "applicable_timetable": "Y",
+        "atoc_code": "XX",
+        "new_schedule_segment": {"traction_class": "", "uic_code": ""},
+        "schedule_days_runs": days,
+        "schedule_end_date": end.isoformat(),
+        "schedule_segment": {
+            "signalling_id": "2A00",
+            "CIF_train_category": "OO",
+            "CIF_headcode": "",
+            "CIF_course_indicator": 1,
+            "CIF_train_service_code": service_code,
+            "CIF_business_sector": "??",
+            "CIF_power_type": "EMU",
+            "CIF_timing_load": None,
+            "CIF_speed": "100",
+            "CIF_operating_characteristics": None,
+            "CIF_train_class": "S",
+            "CIF_sleepers": None,
+            "CIF_reservations": None,
+            "CIF_connection_indicator": None,
+            "CIF_catering_code": None,
+            "CIF_service_branding": "",
+            "schedule_location": locations,
+        },
+        "schedule_start_date": start.isoformat(),
+        "train_status": "P",
+        "transaction_type": "Create",
+    }}
+
+
+def departure_minute(rng):
+    # Busier in the peaks
+    if rng.random() < 0.45:
+        return rng.choice([rng.gauss(8 * 60, 50), rng.gauss(17.5 * 60, 50)])
+    return rng.uniform(5 * 60, 23 * 60 + 30)
+
+
+def iter_schedules(rng, routes, n_trains):
+    """JsonScheduleV1 records: permanent services, plus overlays, cancellations and new schedules."""
+    london = [r for r in routes if r[0] in {codes[0] for codes in terminal_tiplocs.values()}]
+    cross = [r for r in routes if r not in london]
+    period_days = (PERIOD_END - PERIOD_START).days
+    permanent = []
+
+    for i in range(n_trains):
+        stp = weighted(rng, STP_MIX)
+        if stp in ("O", "C") and permanent:
+            # Overlays and cancellations replace an existing permanent schedule for a few days
+            uid, route, depart, stop_share, days = rng.choice(permanent)
+            start = PERIOD_START + timedelta(days=rng.randint(0, period_days - 1))
+            end = min(PERIOD_END, start + timedelta(days=rng.randint(0, 13)))
+            if stp == "C":
+                yield {"JsonScheduleV1": {
+                    "CIF_bank_holiday_running": None, "CIF_stp_indicator": "C", "CIF_train_uid": uid,
+                    "applicable_timetable": None, "atoc_code": "XX", "schedule_days_runs": days,
+                    "schedule_end_date": end.isoformat(), "schedule_start_date": start.isoformat(),
+                    "train_status": " ", "transaction_type": "Create",
+                    "schedule_segment": {"signalling_id": None, "schedule_location": []},
+                }}
+                continue
+            locations = schedule_locations(rng, route, depart + rng.choice([-5, 0, 5, 10]), stop_share)
+            yield schedule_record(uid, "O", start, end, days, locations, f"{i % 99999999:08d}")
+            continue
+
+        uid = f"{chr(65 + i // 100_000 % 26)}{i % 100_000:05d}"
+        route = rng.choice(cross if cross and rng.random() < CROSS_COUNTRY_SHARE else london)
+        if rng.random() < 0.5:
+            route = route[::-1]
+        # Shorter workings turn back part-way along the branch
+        if len(route) > 6 and rng.random() < 0.4:
+            cut = rng.randint(4, len(route) - 1)
+            route = route[:cut] if rng.random() < 0.5 else route[-cut:]
+        depart = departure_minute(rng)
+        stop_share = weighted(rng, STOPPING_PATTERNS)
+        days = weighted(rng, DAY_PATTERNS)
+        if stp == "N":
+            start = PERIOD_START + timedelta(days=rng.randint(0, period_days - 1))
+            end = min(PERIOD_END, start + timedelta(days=rng.randint(0, 27)))
+        else:
+            start, end = PERIOD_START, PERIOD_END
+            permanent.append((uid, route, depart, stop_share, days))
+        yield schedule_record(uid, stp if stp == "N" else "P", start, end, days,
+                              schedule_locations(rng, route, depart, stop_share), f"{i % 99999999:08d}")
+
+
+def generate_timetable(path, n_trains, n_stations=2500, seed=1, reference_path=None):
+    """Write a toc-full-shaped JSON lines extract: header, TiplocV1 and JsonScheduleV1 records, EOF.
+
+    With reference_path, also write the stations' coordinates as a station_reference.py CSV.
+    Returns (tiploc count, schedule count).
+    """
+    rng = random.Random(seed)
+    tiplocs, routes = build_network(rng, n_stations)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    schedules = 0
+    with open(path, "w") as f:
+        def write(record):
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+        write({"JsonTimetableV1": {
+            "classification": "public", "timestamp": 1_780_000_000, "owner": "Network Rail",
+            "Sender": {"organisation": "Rockshore", "application": "NTROD", "component": "SCHEDULE"},
+            "Metadata": {"type": "full", "sequence": 1},
+        }})
+        for code, (name, _, _, is_station) in tiplocs.items():
+            write({"TiplocV1": {
+                "transaction_type": "Create", "tiploc_code": code, "nalco": "000000", "stanox": "00000",
+                "crs_code": None, "description": name if is_station else None,
+                "tps_description": name,
+            }})
+        for record in iter_schedules(rng, routes, n_trains):
+            write(record)
+            schedules += 1
+        write({"EOF": True})
+
+    if reference_path:
+        os.makedirs(os.path.dirname(reference_path) or ".", exist_ok=True)
+        with open(reference_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["TiplocCode", "StationName", "Latitude", "Longitude"])
+            for code, (name, lat, lon, is_station) in tiplocs.items():
+                if is_station:
+                    writer.writerow([code, name, f"{lat:.6f}", f"{lon:.6f}"])
+    return len(tiplocs), schedules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic toc-full extract for benchmarking.")
+    parser.add_argument("--output", default="data/synthetic/toc-full")
+    parser.add_argument("--trains", type=int, default=20_000, help="Schedule records to generate")
+    parser.add_argument("--stations", type=int, default=2500, help="Approximate number of stations")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reference", help="Also write station coordinates here (see station_reference.py)")
+    args = parser.parse_args()
+
+    n_tiplocs, n_schedules = generate_timetable(args.output, args.trains, args.stations, args.seed, args.reference)
+    print(f"Wrote {n_tiplocs} TIPLOCs and {n_schedules} schedules to {args.output}")
@@ -0,0 +1,31 @@
+
+################################################################
+### Minute-of-day encoding for public times in the timetable ###
+################################################################
+
+import re
+
+_NON_DIGITS = re.compile(r"[^\d]")
+
+
+def encode_time(t):
+    """Convert an 'HHMM' time to minutes after midnight, or None if it cannot be parsed.
+
+    Non-digits (such as the 'H' half-minute suffix on working times) are ignored, as the
+    original clean_time did.
+    """
+    if not t:
+        return None
+    t = _NON_DIGITS.sub("", t)
+    if len(t) != 4:
+        return None
+    hours, minutes = int(t[:2]), int(t[2:])
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+
+def format_minutes(minutes):
+    """Format minutes after midnight as 'HH:MM', wrapping past midnight."""
+    minutes = int(minutes) % 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
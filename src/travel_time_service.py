@@ -0,0 +1,402 @@
+
+####################################################################
+### Local HTTP service answering travel-time queries from memory ###
+####################################################################
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from calendar_index import CalendarIndex
+from expected_travel_times import (CACHE_DIR, DAY_NAMES, DB_PATH, DEFAULT_DAYS, DEFAULT_STEP, DEFAULT_WINDOW,
+                                   load_terminal_pairs, parse_days, parse_window, terminal_tiplocs)
+from time_encoding import format_minutes
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Hot queries remembered per loaded timetable; a reload starts with an empty cache
+QUERY_CACHE_SIZE = 65_536
+# Calendar dates whose train selection is kept built at once
+DATE_INDEXES = 16
+# Seconds between checks of the source for a refresh
+POLL_SECONDS = 5.0
+
+
+class DepartureIndex:
+    """Soonest arrival after any time for every (terminal, stop), over one selection of trains.
+
+    The same sweep as soonest_arrivals, kept in memory: pairs are sorted by (terminal, stop,
+    departure) and each position holds the best arrival among that departure and all later
+    ones, so a point query is one binary search inside its (terminal, stop) run.
+    """
+
+    def __init__(self, group, dep, arr, train_id, n_groups):
+        n = len(group)
+        order = np.lexsort((dep, group))
+        sorted_groups = group[order]
+        # arr * n + row orders by arrival, then by original row, as in soonest_arrivals
+        best = arr[order].astype(np.int64) * max(n, 1) + order
+        suffix_best = pd.Series(best[::-1]).groupby(sorted_groups[::-1]).cummin().to_numpy()[::-1]
+        row = suffix_best % max(n, 1)
+
+        self.offsets = np.searchsorted(sorted_groups, np.arange(n_groups + 1))
+        self.dep = np.ascontiguousarray(dep[order])
+        self.best_dep = dep[row]
+        self.best_arr = arr[row]
+        self.best_train = train_id[row]
+
+    def soonest(self, group, t):
+        """(departure, arrival, train_id) of the soonest arrival leaving after minute t, or None."""
+        lo, hi = self.offsets[group], self.offsets[group + 1]
+        i = lo + self.dep[lo:hi].searchsorted(t, side="right")
+        if i == hi:
+            return None
+        return int(self.best_dep[i]), int(self.best_arr[i]), int(self.best_train[i])
+
+    def expected(self, group, time_points):
+        """Mean minutes to arrival over the time points that have a later train, and their count."""
+        lo, hi = self.offsets[group], self.offsets[group + 1]
+        i = lo + self.dep[lo:hi].searchsorted(time_points, side="right")
+        found = i < hi
+        if not found.any():
+            return None, 0
+        elapsed = self.best_arr[i[found]] - time_points[found]
+        # np.round rather than round, to match the batch summary's rounding of halves
+        return float(np.round(elapsed.mean(), 1)), int(found.sum())
+
+
+class TravelTimes:
+    """Terminal pairs held as DepartureIndexes, built per day set or calendar date on first use."""
+
+    def __init__(self, pairs, calendar=None, source=None, cache_size=QUERY_CACHE_SIZE):
+        pairs = pairs[pairs["stop_name"].notna()]
+        stop_codes, stops = pd.factorize(pairs["stop_name"].astype(str), sort=True)
+        self.terminals = list(terminal_tiplocs)
+        self.stops = list(stops)
+        self.terminal_code = {name: i for i, name in enumerate(self.terminals)}
+        self.stop_code = {name.upper(): i for i, name in enumerate(self.stops)}
+
+        terminal_codes = pd.Categorical(pairs["terminal"].astype(str), categories=self.terminals).codes
+        self.group = terminal_codes.astype(np.int64) * len(self.stops) + stop_codes
+        self.n_groups = len(self.terminals) * len(self.stops)
+        self.dep = pairs["terminal_dep_time"].to_numpy(np.int16)
+        self.arr = pairs["arr_time"].to_numpy(np.int16)
+        self.train_id = pairs["train_id"].to_numpy(np.int32)
+        self.runs = pairs["runs"].to_numpy(np.uint8)
+
+        self.calendar = calendar
+        self.source = source
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+        self.by_days = {}
+        self.by_date = OrderedDict()
+        # Bound to this timetable, so the cache goes with it on reload
+        self.soonest = functools.lru_cache(maxsize=cache_size)(self._soonest)
+        self.expected = functools.lru_cache(maxsize=cache_size)(self._expected)
+
+    def _build(self, keep):
+        return DepartureIndex(self.group[keep], self.dep[keep], self.arr[keep], self.train_id[keep], self.n_groups)
+
+    def lookup(self, selection):
+        """The built DepartureIndex for ('days', bitmask) or ('date', 'YYYY-MM-DD'), or None."""
+        kind, value = selection
+        if kind == "days":
+            return self.by_days.get(value)
+        index = self.by_date.get(value)
+        if index is not None:
+            self.by_date.move_to_end(value)
+        return index
+
+    def build(self, selection):
+        """A new DepartureIndex for the selection. Leaves the built indexes alone, so it can run
+        in a worker thread while queries use them."""
+        kind, value = selection
+        if kind == "days":
+            return self._build((self.runs & value) != 0)
+        if self.calendar is None:
+            raise ValueError("Dates need the timetable database as the source")
+        running = self.calendar.running_on(date.fromisoformat(value))
+        return self._build(np.isin(self.train_id, running))
+
+    def add(self, selection, index):
+        kind, value = selection
+        if kind == "days":
+            self.by_days[value] = index
+        else:
+            self.by_date[value] = index
+            if len(self.by_date) > DATE_INDEXES:
+                self.by_date.popitem(last=False)
+        return index
+
+    def index(self, selection):
+        index = self.lookup(selection)
+        return index if index is not None else self.add(selection, self.build(selection))
+
+    def group_of(self, terminal, stop):
+        terminal = terminal.strip().upper()
+        if terminal not in self.terminal_code:
+            raise LookupError(f"Unknown terminal {terminal!r}")
+        stop_code = self.stop_code.get(stop.strip().upper())
+        if stop_code is None:
+            raise LookupError(f"No trains from the terminals call at {stop!r}")
+        return self.terminal_code[terminal] * len(self.stops) + stop_code
+
+    def _soonest(self, group, t, selection):
+        return self.index(selection).soonest(group, t)
+
+    def _expected(self, group, start, end, step, selection):
+        return self.index(selection).expected(group, np.arange(start, end, step, dtype=np.int64))
+
+    def stats(self):
+        return {
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "pairs": len(self.group),
+            "terminals": len(self.terminals),
+            "stops": len(self.stops),
+            "indexes": [",".join(day for i, day in enumerate(DAY_NAMES) if mask >> i & 1) for mask in self.by_days]
+                       + list(self.by_date),
+            "soonest_cache": self.soonest.cache_info()._asdict(),
+            "expected_cache": self.expected.cache_info()._asdict(),
+        }
+
+
+def load_travel_times(path=None, db_path=DB_PATH, cache_dir=CACHE_DIR, days=(DEFAULT_DAYS,)):
+    """TravelTimes from the database (or a london_trains extract), with indexes for days prebuilt."""
+    pairs = load_terminal_pairs(path, cache_dir=cache_dir, db_path=db_path)
+    calendar = None
+    if not path:
+        conn = sqlite3.connect(db_path)
+        calendar = CalendarIndex.from_db(conn)
+        conn.close()
+    travel_times = TravelTimes(pairs, calendar, source=path or db_path)
+    for day_set in days:
+        travel_times.index(("days", parse_days(day_set)))
+    return travel_times
+
+
+# --- Queries ---
+def parse_clock(value):
+    """'17:30' or '1730' -> minutes after midnight."""
+    digits = value.replace(":", "")
+    if len(digits) != 4 or not digits.isdigit() or int(digits[:2]) > 23 or int(digits[2:]) > 59:
+        raise ValueError(f"Time {value!r} must be HH:MM")
+    return int(digits[:2]) * 60 + int(digits[2:])
+
+
+def selection(params):
+    if "date" in params:
+        date.fromisoformat(params["date"])
+        return ("date", params["date"])
+    return ("days", parse_days(params.get("days", DEFAULT_DAYS)))
+
+
+def query_soonest(travel_times, params):
+    group = travel_times.group_of(params["terminal"], params["stop"])
+    after = parse_clock(params["after"])
+    found = travel_times.soonest(group, after, selection(params))
+    if found is None:
+        raise LookupError(f"No later train from {params['terminal']} to {params['stop']}")
+    departure, arrival, train_id = found
+    return {
+        "terminal": travel_times.terminals[group // len(travel_times.stops)],
+        "stop": travel_times.stops[group % len(travel_times.stops)],
+        "after": format_minutes(after),
+        "departure": format_minutes(departure),
+        "arrival": format_minutes(arrival),
+        "minutes": arrival - after,
+        "train_id": train_id,
+    }
+
+
+def query_expected(travel_times, params):
+    group = travel_times.group_of(params["terminal"], params["stop"])
+    window = params.get("window", DEFAULT_WINDOW)
+    start, end = parse_window(window)
+    step = int(params.get("step", DEFAULT_STEP))
+    if step < 1:
+        raise ValueError("step must be at least 1")
+    expected_minutes, samples = travel_times.expected(group, start, end, step, selection(params))
+    return {
+        "terminal": travel_times.terminals[group // len(travel_times.stops)],
+        "stop": travel_times.stops[group % len(travel_times.stops)],
+        "window": window,
+        "expected_minutes": expected_minutes,
+        "samples": samples,
+    }
+
+
+ROUTES = {
+    "/soonest": query_soonest,
+    "/expected": query_expected,
+    "/stats": lambda travel_times, params: travel_times.stats(),
+}
+# Routes that need the index for the request's day set or date
+INDEXED_ROUTES = ("/soonest", "/expected")
+
+
+# --- Server ---
+class TravelTimeServer:
+    """Answers GET requests against the loaded TravelTimes, reloading it when the source changes."""
+
+    def __init__(self, path=None, db_path=DB_PATH, cache_dir=CACHE_DIR, days=(DEFAULT_DAYS,)):
+        self.load = functools.partial(load_travel_times, path, db_path, cache_dir, days)
+        self.source = path or db_path
+        self.travel_times = None
+        self.signature = None
+        # Index builds in progress, shared by every request waiting on the same one
+        self.building = {}
+
+    def source_signature(self):
+        # The database and its write-ahead log, if any
+        paths = [self.source, self.source + "-wal"]
+        return tuple((os.stat(p).st_size, os.stat(p).st_mtime_ns) if os.path.exists(p) else None for p in paths)
+
+    async def reload(self):
+        signature = self.source_signature()
+        start = time.perf_counter()
+        # Built off the event loop; queries keep using the previous timetable meanwhile
+        self.travel_times = await asyncio.get_running_loop().run_in_executor(None, self.load)
+        self.signature = signature
+        print(f"Loaded {len(self.travel_times.group):,} terminal pairs from {self.source} "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    async def watch(self, interval=POLL_SECONDS):
+        """Reload once the source has changed and then stayed the same for a whole interval."""
+        pending = None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                signature = self.source_signature()
+                if signature == self.signature:
+                    pending = None
+                elif signature != pending:
+                    pending = signature
+                else:
+                    await self.reload()
+                    pending = None
+            except Exception as e:
+                # A half-written refresh; keep serving and try again on the next change
+                print(f"Reload failed, still serving {self.travel_times.loaded_at}: {e}")
+                self.signature = pending
+
+    async def prepare(self, travel_times, selection):
+        """Build a missing index off the event loop, so other connections are answered meanwhile."""
+        if travel_times.lookup(selection) is not None:
+            return
+        key = (travel_times, selection)
+        build = self.building.get(key)
+        if build is None:
+            build = asyncio.get_running_loop().run_in_executor(None, travel_times.build, selection)
+            self.building[key] = build
+
+            def built(future):
+                del self.building[key]
+                if not future.cancelled() and future.exception() is None:
+                    travel_times.add(selection, future.result())
+            build.add_done_callback(built)
+        await build
+
+    async def respond(self, method, target):
+        if method != "GET":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Only GET is supported"}
+        url = urlsplit(target)
+        route = ROUTES.get(url.path)
+        if route is None:
+            return HTTPStatus.NOT_FOUND, {"error": f"Unknown path; use {', '.join(ROUTES)}"}
+        params = dict(parse_qsl(url.query))
+        # A reload may swap the timetable while this request waits for its index
+        travel_times = self.travel_times
+        try:
+            if url.path in INDEXED_ROUTES:
+                await self.prepare(travel_times, selection(params))
+            return HTTPStatus.OK, route(travel_times, params)
+        except KeyError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": f"Missing parameter {e.args[0]}"}
+        except IndexError:
+            # A LookupError too, but from a bug rather than an unknown terminal or stop
+            raise
+        except LookupError as e:
+            return HTTPStatus.NOT_FOUND, {"error": str(e)}
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+
+    async def handle(self, reader, writer):
+        """HTTP/1.1 with keep-alive, enough for local clients and load generators."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if "content-length" in headers:
+                    await reader.readexactly(int(headers["content-length"]))
+
+                try:
+                    status, body = await self.respond(method, target)
+                except Exception as e:
+                    # A bug in a query, not the client's fault; answer it and keep the connection
+                    print(f"Error answering {target}: {e!r}")
+                    status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"Internal error: {e}"}
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                payload = json.dumps(body).encode()
+                head = [f"HTTP/1.1 {status.value} {status.phrase}", "Content-Type: application/json",
+                        f"Content-Length: {len(payload)}"]
+                if not keep_alive:
+                    head.append("Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, interval=POLL_SECONDS):
+        await self.reload()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving travel times on http://{host}:{port} ({', '.join(ROUTES)})")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch(interval))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve soonest-arrival and expected travel time queries from "
+                                                 "the terminals over HTTP, e.g. /soonest?terminal=LONDON WATERLOO"
+                                                 "&stop=SURBITON&after=17:30 or /expected?terminal=...&stop=..."
+                                                 "&window=17:00-19:00&days=tue")
+    parser.add_argument("--db", default=DB_PATH, help="Timetable database, reloaded when it changes")
+    parser.add_argument("--input", help="Serve a get_london_terminal_services.py output instead of --db")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--days", action="append",
+                        help=f"Day sets to index at load, repeatable (default {DEFAULT_DAYS}); others are "
+                             "indexed on first use")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="Seconds between checks for a refresh")
+    parser.add_argument("--no-cache", action="store_true", help="Rebuild the prepared terminal pairs")
+    args = parser.parse_args()
+
+    server = TravelTimeServer(args.input, args.db, None if args.no_cache else CACHE_DIR, args.days or [DEFAULT_DAYS])
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.poll))
+    except KeyboardInterrupt:
+        pass
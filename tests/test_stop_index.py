@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from stop_index import StopIndex
+
+STOPS = pd.DataFrame({
+    "stop": ["SURBITON", "WIMBLEDON", "WOKING"],
+    "lat": [51.3925, 51.4214, 51.3185],
+    "lon": [-0.3041, -0.2064, -0.5569],
+    "best_minutes": [18.0, 12.0, 27.0],
+    "best_terminal": ["LONDON WATERLOO"] * 3,
+})
+MINUTES = pd.DataFrame({"LONDON WATERLOO": [18.0, 12.0, 27.0]})
+
+
+def test_nearest_with_no_query_points():
+    matches = StopIndex(STOPS, MINUTES).nearest(np.empty(0), np.empty(0), k=2)
+    assert matches.empty
+    assert list(matches.columns) == ["query", "rank"] + list(STOPS.columns) + ["distance_km"]
+
+
+def test_radius_with_no_query_points():
+    matches = StopIndex(STOPS, MINUTES).radius(np.empty(0), np.empty(0), 10)
+    assert matches.empty
+    assert list(matches.columns) == ["query"] + list(STOPS.columns) + ["distance_km"]
+
+
+def test_nearest_finds_closest_first():
+    matches = StopIndex(STOPS, MINUTES).nearest([51.40], [-0.29], k=2)
+    assert list(matches["stop"]) == ["SURBITON", "WIMBLEDON"]
+    assert list(matches["rank"]) == [1, 2]
+
+
+def test_nothing_reachable_gives_an_empty_index():
+    index = StopIndex(STOPS, MINUTES).reachable(5)
+    assert index.stops.empty
+    assert index.nearest([51.40], [-0.29], k=2).empty
+    assert index.radius([51.40], [-0.29], 50).empty
+    assert index.within_box(51, -1, 52, 0).empty